@@ -0,0 +1,78 @@
+"""add book full-text search index
+
+Revision ID: ce29fd78c2bc
+Revises: 873737d287d3
+Create Date: 2026-10-18 10:12:31.518204
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "ce29fd78c2bc"
+down_revision: Union[str, None] = "873737d287d3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# NOTE: sqlite drops triggers when a table is recreated. Migrations that use
+# batch_alter_table on bookrequest have to recreate the triggers afterwards.
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE VIRTUAL TABLE book_fts USING fts5(
+            asin UNINDEXED,
+            title,
+            subtitle,
+            authors,
+            narrators,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+        """
+    )
+    # a book can be requested by multiple users, so there is only ever one entry per asin
+    op.execute(
+        """
+        CREATE TRIGGER book_fts_bookrequest_insert AFTER INSERT ON bookrequest BEGIN
+            DELETE FROM book_fts WHERE asin = new.asin;
+            INSERT INTO book_fts (asin, title, subtitle, authors, narrators)
+            VALUES (new.asin, new.title, new.subtitle, new.authors, new.narrators);
+        END
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER book_fts_bookrequest_update AFTER UPDATE ON bookrequest BEGIN
+            DELETE FROM book_fts WHERE asin = new.asin;
+            INSERT INTO book_fts (asin, title, subtitle, authors, narrators)
+            VALUES (new.asin, new.title, new.subtitle, new.authors, new.narrators);
+        END
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER book_fts_bookrequest_delete AFTER DELETE ON bookrequest BEGIN
+            DELETE FROM book_fts WHERE asin = old.asin;
+            INSERT INTO book_fts (asin, title, subtitle, authors, narrators)
+            SELECT asin, title, subtitle, authors, narrators
+            FROM bookrequest WHERE asin = old.asin LIMIT 1;
+        END
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO book_fts (asin, title, subtitle, authors, narrators)
+        SELECT asin, title, subtitle, authors, narrators
+        FROM bookrequest GROUP BY asin
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS book_fts_bookrequest_insert")
+    op.execute("DROP TRIGGER IF EXISTS book_fts_bookrequest_update")
+    op.execute("DROP TRIGGER IF EXISTS book_fts_bookrequest_delete")
+    op.execute("DROP TABLE IF EXISTS book_fts")
@@ -0,0 +1,152 @@
+"""move cached book details into bookmetadata
+
+Revision ID: ef6c058ac3f7
+Revises: ce29fd78c2bc
+Create Date: 2026-10-18 13:40:07.291843
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "ef6c058ac3f7"
+down_revision: Union[str, None] = "ce29fd78c2bc"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+_book_columns = "asin, title, subtitle, authors, narrators"
+
+
+def _create_fts_triggers(table: str):
+    # a book can be stored in both tables, so there is only ever one entry per asin
+    for event in ["insert", "update"]:
+        op.execute(
+            f"""
+            CREATE TRIGGER book_fts_{table}_{event} AFTER {event.upper()} ON {table} BEGIN
+                DELETE FROM book_fts WHERE asin = new.asin;
+                INSERT INTO book_fts ({_book_columns})
+                VALUES (new.asin, new.title, new.subtitle, new.authors, new.narrators);
+            END
+            """
+        )
+    op.execute(
+        f"""
+        CREATE TRIGGER book_fts_{table}_delete AFTER DELETE ON {table} BEGIN
+            DELETE FROM book_fts WHERE asin = old.asin;
+            INSERT INTO book_fts ({_book_columns})
+            SELECT {_book_columns} FROM (
+                SELECT {_book_columns} FROM bookmetadata WHERE asin = old.asin
+                UNION ALL
+                SELECT {_book_columns} FROM bookrequest WHERE asin = old.asin
+            ) LIMIT 1;
+        END
+        """
+    )
+
+
+def _drop_fts_triggers(table: str):
+    for event in ["insert", "update", "delete"]:
+        op.execute(f"DROP TRIGGER IF EXISTS book_fts_{table}_{event}")
+
+
+def upgrade() -> None:
+    op.create_table(
+        "bookmetadata",
+        sa.Column("asin", sa.String(), nullable=False),
+        sa.Column("region", sa.String(), nullable=False),
+        sa.Column("title", sa.String(), nullable=False),
+        sa.Column("subtitle", sa.String(), nullable=True),
+        sa.Column("authors", sa.JSON(), nullable=True),
+        sa.Column("narrators", sa.JSON(), nullable=True),
+        sa.Column("cover_image", sa.String(), nullable=True),
+        sa.Column("release_date", sa.DateTime(), nullable=False),
+        sa.Column("runtime_length_min", sa.Integer(), nullable=False),
+        sa.Column(
+            "fetched_at",
+            sa.DateTime(),
+            server_default=sa.text("(CURRENT_TIMESTAMP)"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("asin", "region"),
+    )
+    with op.batch_alter_table("bookmetadata", schema=None) as batch_op:
+        batch_op.create_index(
+            batch_op.f("ix_bookmetadata_fetched_at"), ["fetched_at"], unique=False
+        )
+
+    # the region of previously cached books is unknown. Most searches use the default region
+    op.execute(
+        """
+        INSERT INTO bookmetadata (asin, region, title, subtitle, authors, narrators,
+            cover_image, release_date, runtime_length_min, fetched_at)
+        SELECT asin, 'us', title, subtitle, authors, narrators,
+            cover_image, release_date, runtime_length_min, max(updated_at)
+        FROM bookrequest WHERE user_username IS NULL GROUP BY asin
+        """
+    )
+
+    _drop_fts_triggers("bookrequest")
+    op.execute("DELETE FROM bookrequest WHERE user_username IS NULL")
+    _create_fts_triggers("bookrequest")
+    _create_fts_triggers("bookmetadata")
+    op.execute("DELETE FROM book_fts")
+    op.execute(
+        f"""
+        INSERT INTO book_fts ({_book_columns})
+        SELECT {_book_columns} FROM bookmetadata GROUP BY asin
+        UNION ALL
+        SELECT {_book_columns} FROM bookrequest
+        WHERE asin NOT IN (SELECT asin FROM bookmetadata) GROUP BY asin
+        """
+    )
+
+
+def downgrade() -> None:
+    _drop_fts_triggers("bookmetadata")
+    _drop_fts_triggers("bookrequest")
+    op.execute(
+        """
+        INSERT INTO bookrequest (id, asin, title, subtitle, authors, narrators,
+            cover_image, release_date, runtime_length_min, downloaded, updated_at)
+        SELECT lower(hex(randomblob(16))), asin, title, subtitle, authors, narrators,
+            cover_image, release_date, runtime_length_min, false, max(fetched_at)
+        FROM bookmetadata GROUP BY asin
+        """
+    )
+    with op.batch_alter_table("bookmetadata", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_bookmetadata_fetched_at"))
+    op.drop_table("bookmetadata")
+
+    # restore the triggers of the previous revision
+    op.execute(
+        f"""
+        CREATE TRIGGER book_fts_bookrequest_delete AFTER DELETE ON bookrequest BEGIN
+            DELETE FROM book_fts WHERE asin = old.asin;
+            INSERT INTO book_fts ({_book_columns})
+            SELECT {_book_columns}
+            FROM bookrequest WHERE asin = old.asin LIMIT 1;
+        END
+        """
+    )
+    for event in ["insert", "update"]:
+        op.execute(
+            f"""
+            CREATE TRIGGER book_fts_bookrequest_{event} AFTER {event.upper()} ON bookrequest BEGIN
+                DELETE FROM book_fts WHERE asin = new.asin;
+                INSERT INTO book_fts ({_book_columns})
+                VALUES (new.asin, new.title, new.subtitle, new.authors, new.narrators);
+            END
+            """
+        )
+    op.execute("DELETE FROM book_fts")
+    op.execute(
+        f"""
+        INSERT INTO book_fts ({_book_columns})
+        SELECT {_book_columns} FROM bookrequest GROUP BY asin
+        """
+    )
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Iterable, Optional, Sequence
+
+import pydantic
+from aiohttp import ClientError, ClientSession
+from fastapi import HTTPException
+from sqlmodel import Session, col, select
+
+from app.internal.indexers.abstract import SessionContainer
+from app.internal.models import BookRequest, User
+from app.internal.prowlarr.prowlarr import (
+    cache_sources,
+    prowlarr_config,
+    query_prowlarr_broad,
+)
+from app.internal.prowlarr.source_metadata import edit_source_metadata
+from app.internal.query import query_sources, querying
+from app.internal.ranking.download_ranking import matches_book
+
+logger = logging.getLogger(__name__)
+
+# authors with fewer wishlisted books are searched for book by book
+MIN_BATCH_SIZE = 2
+# amount of books that are ranked and downloaded at the same time
+BACKLOG_CONCURRENCY = 4
+
+
+class BacklogPlan(pydantic.BaseModel):
+    author_batches: dict[str, list[BookRequest]]
+    single_books: list[BookRequest]
+
+    @property
+    def size(self) -> int:
+        return len(self.single_books) + sum(
+            len(books) for books in self.author_batches.values()
+        )
+
+
+def get_trusted_usernames(session: Session) -> set[str]:
+    """Users whose requests are allowed to be downloaded automatically"""
+    users = session.exec(select(User)).all()
+    return {user.username for user in users if user.can_download()}
+
+
+def get_backlog(
+    session: Session, asins: Optional[Iterable[str]] = None
+) -> list[BookRequest]:
+    """
+    Requested books that have not been downloaded yet, once per book. If possible the
+    request of a user that is allowed to download is used for every book.
+    """
+    query = select(BookRequest).where(
+        col(BookRequest.user_username).is_not(None),
+        col(BookRequest.downloaded).is_(False),
+    )
+    if asins is not None:
+        query = query.where(col(BookRequest.asin).in_(list(asins)))
+    requests = session.exec(query.order_by(col(BookRequest.updated_at))).all()
+    trusted = get_trusted_usernames(session)
+
+    books: dict[str, BookRequest] = {}
+    for book in requests:
+        if book.asin in querying:
+            continue
+        current = books.get(book.asin)
+        if current is None or (
+            current.user_username not in trusted and book.user_username in trusted
+        ):
+            books[book.asin] = book
+    return list(books.values())
+
+
+def plan_backlog(books: Sequence[BookRequest]) -> BacklogPlan:
+    """
+    Groups the books by their first author. Every group is searched for with a single
+    query for the author instead of a query for every book.
+    """
+    by_author: dict[str, list[BookRequest]] = defaultdict(list)
+    author_names: dict[str, str] = {}
+    single_books: list[BookRequest] = []
+    for book in books:
+        if not book.authors:
+            single_books.append(book)
+            continue
+        author = " ".join(book.authors[0].split())
+        author_names.setdefault(author.lower(), author)
+        by_author[author.lower()].append(book)
+
+    author_batches: dict[str, list[BookRequest]] = {}
+    for key, author_books in by_author.items():
+        if len(author_books) >= MIN_BATCH_SIZE:
+            author_batches[author_names[key]] = author_books
+        else:
+            single_books.extend(author_books)
+
+    return BacklogPlan(author_batches=author_batches, single_books=single_books)
+
+
+async def _search_author(
+    session: Session,
+    client_session: ClientSession,
+    author: str,
+    books: list[BookRequest],
+) -> list[BookRequest]:
+    """
+    Searches for all books of the author at once and caches the matching sources
+    of each book. Returns the books without any matching sources.
+    """
+    try:
+        sources = await query_prowlarr_broad(
+            session, client_session, author, [book.title for book in books]
+        )
+    except ClientError as e:
+        logger.warning("Failed to search for books by %s: %s", author, e)
+        return books
+
+    container = SessionContainer(session=session, client_session=client_session)
+    unmatched: list[BookRequest] = []
+    for book in books:
+        book_sources = [
+            # copied, as the additional metadata depends on the book
+            source.model_copy(deep=True)
+            for source in sources
+            if matches_book(session, source, book)
+        ]
+        if not book_sources:
+            unmatched.append(book)
+            continue
+        await edit_source_metadata(book, book_sources, container)
+        await cache_sources(session, client_session, book, book_sources)
+
+    logger.debug(
+        "Found sources for %d of %d books by %s",
+        len(books) - len(unmatched),
+        len(books),
+        author,
+    )
+    return unmatched
+
+
+async def search_backlog(
+    session: Session,
+    client_session: ClientSession,
+    start_auto_download: bool = False,
+    books: Optional[Sequence[BookRequest]] = None,
+):
+    """
+    Searches sources for the books of the backlog, which defaults to all requested books
+    that have not been downloaded yet. Books of the same author are searched for with a
+    single query, only books that are not found that way are searched for one by one.
+
+    With `start_auto_download` the best source is downloaded if it is valid and the book
+    was requested by a user that is allowed to download.
+    """
+    prowlarr_config.raise_if_invalid(session)
+    if books is None:
+        books = get_backlog(session)
+    plan = plan_backlog(books)
+    if plan.size == 0:
+        return
+
+    unmatched = await asyncio.gather(
+        *[
+            _search_author(session, client_session, author, author_books)
+            for author, author_books in plan.author_batches.items()
+        ]
+    )
+    single_searches = len(plan.single_books) + sum(len(books) for books in unmatched)
+    logger.info(
+        "Searching sources for %d books with %d author and %d book queries",
+        plan.size,
+        len(plan.author_batches),
+        single_searches,
+    )
+
+    # books matched by an author query are ranked from the cached sources
+    trusted = get_trusted_usernames(session)
+    semaphore = asyncio.Semaphore(BACKLOG_CONCURRENCY)
+
+    async def search_book(book: BookRequest):
+        async with semaphore:
+            try:
+                await query_sources(
+                    book.asin,
+                    session=session,
+                    client_session=client_session,
+                    requester_username=book.user_username or "",
+                    start_auto_download=start_auto_download
+                    and book.user_username in trusted,
+                    require_valid_source=True,
+                )
+            except (HTTPException, ClientError) as e:
+                logger.warning("Failed to search sources for %s: %s", book.asin, e)
+
+    await asyncio.gather(*[search_book(book) for book in books])
@@ -1,19 +1,34 @@
 import asyncio
 import logging
+import re
 import time
 from datetime import datetime
-from typing import Any, Literal, Optional
+from typing import Any, Callable, Literal, NamedTuple, Optional
 from urllib.parse import urlencode
 
 import pydantic
-from aiohttp import ClientSession
-from sqlmodel import Session, col, select
-
-from app.internal.models import BookRequest
+from aiohttp import ClientError, ClientSession
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import Session, col, select, text
+
+from app.internal.covers import prewarm_covers
+from app.internal.env_settings import Settings
+from app.internal.models import BookMetadata, BookRequest
+from app.util.background import run_in_background
+from app.util.connection import get_client_session
+from app.util.db import open_session
+from app.util.governor import UpstreamName, get_upstream
+from app.util.persistent_cache import PersistentCache
+from app.util.prefix_index import PrefixIndex
+from app.util.provider_router import ProviderRouter
+from app.util.single_flight import SingleFlight
+from app.util.write_behind import WriteBehind
 
 logger = logging.getLogger(__name__)
 
 REFETCH_TTL = 60 * 60 * 24 * 7  # 1 week
+# expired results are served for this much longer while they are refreshed in the background
+MAX_STALENESS = Settings().search.max_staleness
 
 audible_region_type = Literal[
     "us",
@@ -43,23 +58,10 @@ audible_regions: dict[audible_region_type, str] = {
 }
 
 
-async def _get_audnexus_book(
-    session: ClientSession,
-    asin: str,
-    region: audible_region_type,
-) -> Optional[BookRequest]:
+def _parse_audnexus_book(book: dict[str, Any]) -> BookRequest:
     """
     https://audnex.us/#tag/Books/operation/getBookById
     """
-    async with session.get(
-        f"https://api.audnex.us/books/{asin}?region={region}"
-    ) as response:
-        if not response.ok:
-            logger.warning(
-                f"Failed to fetch book with ASIN {asin} from Audnexus: {response.status}: {response.reason}"
-            )
-            return None
-        book = await response.json()
     return BookRequest(
         asin=book["asin"],
         title=book["title"],
@@ -72,23 +74,10 @@ async def _get_audnexus_book(
     )
 
 
-async def _get_audimeta_book(
-    session: ClientSession,
-    asin: str,
-    region: audible_region_type,
-) -> Optional[BookRequest]:
+def _parse_audimeta_book(book: dict[str, Any]) -> BookRequest:
     """
     https://audimeta.de/api-docs/#/book/get_book__asin_
     """
-    async with session.get(
-        f"https://audimeta.de/book/{asin}?region={region}"
-    ) as response:
-        if not response.ok:
-            logger.warning(
-                f"Failed to fetch book with ASIN {asin} from Audimeta: {response.status}: {response.reason}"
-            )
-            return None
-        book = await response.json()
     return BookRequest(
         asin=book["asin"],
         title=book["title"],
@@ -101,15 +90,95 @@ async def _get_audimeta_book(
     )
 
 
+class MetadataProvider(NamedTuple):
+    display_name: str
+    upstream: UpstreamName
+    url: str
+    parse: Callable[[dict[str, Any]], BookRequest]
+
+
+metadata_providers: dict[str, MetadataProvider] = {
+    "audimeta": MetadataProvider(
+        "Audimeta",
+        "audimeta",
+        "https://audimeta.de/book/{asin}?region={region}",
+        _parse_audimeta_book,
+    ),
+    "audnexus": MetadataProvider(
+        "Audnexus",
+        "audnexus",
+        "https://api.audnex.us/books/{asin}?region={region}",
+        _parse_audnexus_book,
+    ),
+}
+metadata_router = ProviderRouter[BookRequest](list(metadata_providers.keys()))
+
+
+class NotModified(Exception):
+    pass
+
+
+# validators (etag/last-modified) of the last metadata responses, used for conditional requests
+metadata_validators_cache = PersistentCache[str, dict[str, str]](
+    "metadata_validators", REFETCH_TTL + MAX_STALENESS
+)
+
+
+async def _get_provider_book(
+    session: ClientSession,
+    provider: str,
+    asin: str,
+    region: audible_region_type,
+    conditional: bool = False,
+) -> Optional[BookRequest]:
+    """
+    If `conditional` is set, the book is only returned if it changed since the last
+    request to the provider. Otherwise `NotModified` is raised.
+    """
+    metadata_provider = metadata_providers[provider]
+    url = metadata_provider.url.format(asin=asin, region=region)
+
+    headers: dict[str, str] = {}
+    if conditional and (validators := await metadata_validators_cache.get(url)):
+        if etag := validators.value.get("ETag"):
+            headers["If-None-Match"] = etag
+        if last_modified := validators.value.get("Last-Modified"):
+            headers["If-Modified-Since"] = last_modified
+
+    async with get_upstream(metadata_provider.upstream).get(
+        session, url, headers=headers
+    ) as response:
+        if response.status == 304:
+            raise NotModified()
+        if not response.ok:
+            logger.warning(
+                f"Failed to fetch book with ASIN {asin} from {metadata_provider.display_name}: {response.status}: {response.reason}"
+            )
+            return None
+        book = await response.json()
+        validators = {
+            header: response.headers[header]
+            for header in ("ETag", "Last-Modified")
+            if header in response.headers
+        }
+    if validators:
+        await metadata_validators_cache.set(url, validators)
+    return metadata_provider.parse(book)
+
+
 async def get_book_by_asin(
     session: ClientSession,
     asin: str,
     audible_region: audible_region_type = "us",
 ) -> Optional[BookRequest]:
-    book = await _get_audimeta_book(session, asin, audible_region)
-    if book:
-        return book
-    book = await _get_audnexus_book(session, asin, audible_region)
+    """
+    Fetches the book from the healthiest metadata provider first and sends a
+    hedged request to the other one if it takes too long or fails.
+    """
+    book = await metadata_router.fetch(
+        audible_region,
+        lambda provider: _get_provider_book(session, provider, asin, audible_region),
+    )
     if book:
         return book
     logger.warning(
@@ -117,6 +186,64 @@ async def get_book_by_asin(
     )
 
 
+# https://audible.readthedocs.io/en/latest/misc/external_api.html#response-groups
+catalog_response_groups = (
+    "contributors,media,product_attrs,product_desc,product_extended_attrs"
+)
+_required_catalog_fields = ["title", "authors", "release_date", "runtime_length_min"]
+_optional_catalog_fields = ["subtitle", "narrators", "cover_image"]
+
+
+def _parse_catalog_product(product: dict[str, Any]) -> dict[str, Any]:
+    """Extracts all book fields that are included in a catalog product"""
+    fields: dict[str, Any] = {"asin": product["asin"]}
+    if title := product.get("title"):
+        fields["title"] = title
+    if subtitle := product.get("subtitle"):
+        fields["subtitle"] = subtitle
+    if authors := product.get("authors"):
+        fields["authors"] = [author["name"] for author in authors]
+    if narrators := product.get("narrators"):
+        fields["narrators"] = [narrator["name"] for narrator in narrators]
+    images: dict[str, str] = product.get("product_images") or {}
+    if cover_image := images.get("500") or next(iter(images.values()), None):
+        fields["cover_image"] = cover_image
+    if release_date := product.get("release_date") or product.get("issue_date"):
+        fields["release_date"] = datetime.fromisoformat(release_date)
+    if (runtime_length_min := product.get("runtime_length_min")) is not None:
+        fields["runtime_length_min"] = runtime_length_min
+    return fields
+
+
+async def _book_from_catalog_product(
+    client_session: ClientSession,
+    product: dict[str, Any],
+    audible_region: audible_region_type,
+) -> Optional[BookRequest]:
+    """
+    Builds the book straight from the catalog response. Only if required fields are
+    missing, the book is fetched from a metadata provider to fill in the gaps.
+    """
+    fields = _parse_catalog_product(product)
+    if any(f not in fields for f in _required_catalog_fields):
+        book = await get_book_by_asin(client_session, fields["asin"], audible_region)
+        if not book:
+            return None
+        for f in _required_catalog_fields + _optional_catalog_fields:
+            if f not in fields:
+                fields[f] = getattr(book, f)
+    return BookRequest(
+        asin=fields["asin"],
+        title=fields["title"],
+        subtitle=fields.get("subtitle"),
+        authors=fields["authors"],
+        narrators=fields.get("narrators", []),
+        cover_image=fields.get("cover_image"),
+        release_date=fields["release_date"],
+        runtime_length_min=fields["runtime_length_min"],
+    )
+
+
 class CacheQuery(pydantic.BaseModel, frozen=True):
     query: str
     num_results: int
@@ -124,14 +251,79 @@ class CacheQuery(pydantic.BaseModel, frozen=True):
     audible_region: audible_region_type
 
 
-class CacheResult[T](pydantic.BaseModel, frozen=True):
-    value: T
-    timestamp: float
+def _load_books(data: Any) -> list[BookRequest]:
+    return [BookRequest.model_validate(b) for b in data]
+
+
+# time of the last user search. Background refreshes only run while there are no searches
+_last_activity = 0.0
+
+
+def _mark_activity():
+    global _last_activity
+    _last_activity = time.time()
+
+
+# caching of search results to avoid having to fetch from audible so frequently
+search_cache = PersistentCache[CacheQuery, list[BookRequest]](
+    "search", REFETCH_TTL + MAX_STALENESS, loader=_load_books
+)
+
+
+class SuggestionQuery(pydantic.BaseModel, frozen=True):
+    query: str
+    audible_region: audible_region_type
+
+
+search_suggestions_cache = PersistentCache[SuggestionQuery, list[str]](
+    "search_suggestions", REFETCH_TTL
+)
+# concurrent identical searches share a single request to audible
+search_flight = SingleFlight[CacheQuery, list[BookRequest]]()
+
 
+# amount of suggestions that are shown. Audible is only asked if we have fewer locally
+MIN_LOCAL_SUGGESTIONS = 3
+
+# titles of all stored books, shared across regions
+_stored_titles_index: Optional[PrefixIndex] = None
+# titles previously suggested by audible
+_suggestion_indexes: dict[audible_region_type, PrefixIndex] = {}
+
+
+def _get_stored_titles_index() -> PrefixIndex:
+    global _stored_titles_index
+    if _stored_titles_index is None:
+        _stored_titles_index = PrefixIndex()
+        with open_session() as session:
+            _stored_titles_index.add_all(
+                session.exec(select(BookMetadata.title).distinct()).all()
+            )
+            _stored_titles_index.add_all(
+                session.exec(select(BookRequest.title).distinct()).all()
+            )
+        logger.debug("Built suggestion index of %d titles", len(_stored_titles_index))
+    return _stored_titles_index
 
-# simple caching of search results to avoid having to fetch from audible so frequently
-search_cache: dict[CacheQuery, CacheResult[list[BookRequest]]] = {}
-search_suggestions_cache: dict[str, CacheResult[list[str]]] = {}
+
+def _get_suggestion_index(audible_region: audible_region_type) -> PrefixIndex:
+    if audible_region not in _suggestion_indexes:
+        _suggestion_indexes[audible_region] = PrefixIndex()
+    return _suggestion_indexes[audible_region]
+
+
+def get_local_suggestions(
+    query: str,
+    audible_region: audible_region_type = "us",
+    limit: int = MIN_LOCAL_SUGGESTIONS,
+) -> list[str]:
+    suggestions = _get_suggestion_index(audible_region).search(query, limit)
+    for title in _get_stored_titles_index().search(query, limit):
+        if len(suggestions) >= limit:
+            break
+        if title not in suggestions:
+            suggestions.append(title)
+    return suggestions
 
 
 async def get_search_suggestions(
@@ -139,9 +331,20 @@ async def get_search_suggestions(
     query: str,
     audible_region: audible_region_type = "us",
 ) -> list[str]:
-    cache_result = search_suggestions_cache.get(query)
+    """
+    Suggestions are served from the local index of stored books and previous
+    suggestions. Audible is only asked if there are not enough local suggestions.
+    """
+    _mark_activity()
+    local_suggestions = get_local_suggestions(query, audible_region)
+    if len(local_suggestions) >= MIN_LOCAL_SUGGESTIONS:
+        return local_suggestions
+
+    cache_key = SuggestionQuery(query=query, audible_region=audible_region)
+    cache_result = await search_suggestions_cache.get(cache_key)
     if cache_result and time.time() - cache_result.timestamp < REFETCH_TTL:
-        return cache_result.value
+        titles = cache_result.value
+        return titles + [t for t in local_suggestions if t not in titles]
 
     params = {
         "key_strokes": query,
@@ -152,7 +355,7 @@ async def get_search_suggestions(
     )
     url = base_url + urlencode(params)
 
-    async with client_session.get(url) as response:
+    async with get_upstream("audible").get(client_session, url) as response:
         response.raise_for_status()
         results = await response.json()
 
@@ -166,12 +369,12 @@ async def get_search_suggestions(
         .get("value")
     ]
 
-    search_suggestions_cache[query] = CacheResult(
-        value=titles,
-        timestamp=time.time(),
-    )
+    await search_suggestions_cache.set(cache_key, titles)
+    suggestion_index = _get_suggestion_index(audible_region)
+    for title in titles:
+        suggestion_index.add(title)
 
-    return titles
+    return titles + [t for t in local_suggestions if t not in titles]
 
 
 async def list_audible_books(
@@ -187,114 +390,484 @@ async def list_audible_books(
 
     We first use the audible search API to get a list of matching ASINs. Using these ASINs we check our database
     if we have any of the books already to save on the amount of requests we have to do.
-    Any books we don't already have locally, we fetch all the details from audnexus.
+    Any books we don't already have locally are built from the details included in the search response.
+    If the catalog metadata is disabled or incomplete, we fetch all the details from audimeta/audnexus.
     """
+    _mark_activity()
     cache_key = CacheQuery(
         query=query,
         num_results=num_results,
         page=page,
         audible_region=audible_region,
     )
-    cache_result = search_cache.get(cache_key)
+    cache_result = await search_cache.get(cache_key)
 
-    if cache_result and time.time() - cache_result.timestamp < REFETCH_TTL:
+    if cache_result:
+        if time.time() - cache_result.timestamp > REFETCH_TTL:
+            # stale-while-revalidate
+            if not search_flight.is_in_flight(cache_key):
+                run_in_background(_revalidate_search(cache_key))
         return cache_result.value
 
-    params = {
-        "num_results": num_results,
+    return await search_flight.do(
+        cache_key,
+        lambda: _fetch_audible_books(session, client_session, cache_key),
+    )
+
+
+# prefetching runs one page at a time so it never competes much with user searches
+_prefetch_semaphore = asyncio.Semaphore(1)
+
+
+def prefetch_search_pages(
+    query: str,
+    num_results: int,
+    page: int,
+    audible_region: audible_region_type,
+):
+    """
+    Fetches the pages following `page` in the background, so they are cached once
+    requested. The pages are fetched one after another and prefetching stops at the
+    first page that is not full, as there are no further results after it.
+    """
+    depth = Settings().search.prefetch_depth
+    if depth > 0:
+        run_in_background(
+            _prefetch_search_pages(query, num_results, page, audible_region, depth)
+        )
+
+
+async def _prefetch_search_pages(
+    query: str,
+    num_results: int,
+    page: int,
+    audible_region: audible_region_type,
+    depth: int,
+):
+    for next_page in range(page + 1, page + 1 + depth):
+        cache_key = CacheQuery(
+            query=query,
+            num_results=num_results,
+            page=next_page,
+            audible_region=audible_region,
+        )
+        books = await _prefetch_search(cache_key)
+        if len(books) < num_results:
+            return
+
+
+async def _prefetch_search(cache_key: CacheQuery) -> list[BookRequest]:
+    async with _prefetch_semaphore:
+        cache_result = await search_cache.get(cache_key)
+        if cache_result and time.time() - cache_result.timestamp < REFETCH_TTL:
+            return cache_result.value
+        return await _revalidate_search(cache_key)
+
+
+async def _revalidate_search(cache_key: CacheQuery) -> list[BookRequest]:
+    with open_session() as session:
+        return await search_flight.do(
+            cache_key,
+            lambda: _fetch_audible_books(session, get_client_session(), cache_key),
+        )
+
+
+async def _fetch_audible_books(
+    session: Session,
+    client_session: ClientSession,
+    cache_key: CacheQuery,
+) -> list[BookRequest]:
+    audible_region = cache_key.audible_region
+    catalog_metadata = Settings().search.catalog_metadata
+    params: dict[str, Any] = {
+        "num_results": cache_key.num_results,
         "products_sort_by": "Relevance",
-        "keywords": query,
-        "page": page,
+        "keywords": cache_key.query,
+        "page": cache_key.page,
     }
+    if catalog_metadata:
+        params["response_groups"] = catalog_response_groups
+        params["image_sizes"] = "500"
     base_url = (
         f"https://api.audible{audible_regions[audible_region]}/1.0/catalog/products?"
     )
     url = base_url + urlencode(params)
 
-    async with client_session.get(url) as response:
+    async with get_upstream("audible").get(client_session, url) as response:
         response.raise_for_status()
         books_json = await response.json()
 
+    products: list[dict[str, Any]] = books_json["products"]
+
     # do not fetch book results we already have locally
-    asins = set(asin_obj["asin"] for asin_obj in books_json["products"])
-    books = get_existing_books(session, asins)
+    asins = set(product["asin"] for product in products)
+    books = get_existing_books(session, asins, audible_region)
     for key in books.keys():
         asins.remove(key)
 
     # book ASINs we do not have => fetch and store
-    coros = [get_book_by_asin(client_session, asin, audible_region) for asin in asins]
+    if catalog_metadata:
+        coros = [
+            _book_from_catalog_product(client_session, product, audible_region)
+            for product in products
+            if product["asin"] in asins
+        ]
+    else:
+        coros = [
+            get_book_by_asin(client_session, asin, audible_region) for asin in asins
+        ]
     new_books = await asyncio.gather(*coros)
     new_books = [b for b in new_books if b]
-    store_new_books(session, new_books)
+    store_new_books(session, new_books, audible_region)
     for b in new_books:
         books[b.asin] = b
 
     ordered: list[BookRequest] = []
-    for asin_obj in books_json["products"]:
-        book = books.get(asin_obj["asin"])
+    for product in products:
+        book = books.get(product["asin"])
         if book:
             ordered.append(book)
 
-    search_cache[cache_key] = CacheResult(
-        value=ordered,
-        timestamp=time.time(),
-    )
+    await search_cache.set(cache_key, ordered)
+
+    # the result is shared with coalesced searches, which use other database sessions
+    return [BookRequest.model_validate(b) for b in ordered]
+
+
+def get_existing_books(
+    session: Session,
+    asins: set[str],
+    audible_region: audible_region_type = "us",
+) -> dict[str, BookRequest]:
+    """
+    Returns the stored books for the given ASINs. Books that are older than `REFETCH_TTL`
+    are still returned for up to `MAX_STALENESS` while they are refreshed in the background.
+    """
+    now = time.time()
+    oldest = datetime.fromtimestamp(now - REFETCH_TTL - MAX_STALENESS)
+    books = session.exec(
+        select(BookMetadata).where(
+            col(BookMetadata.asin).in_(asins),
+            BookMetadata.region == audible_region,
+            BookMetadata.fetched_at >= oldest,
+        )
+    ).all()
+
+    by_asin = {b.asin: b for b in books}
+    # books that are not written to the database yet
+    for asin in asins:
+        if pending := metadata_writer.get((asin, audible_region)):
+            by_asin[asin] = pending
+
+    stale = {
+        asin
+        for asin, b in by_asin.items()
+        if b.fetched_at.timestamp() + REFETCH_TTL < now
+    }
+    if stale:
+        _revalidate_books(stale, audible_region)
+
+    return {asin: b.to_book_request() for asin, b in by_asin.items()}
+
+
+# books that are currently being refreshed in the background
+_refreshing_books: set[str] = set()
+
+
+def _revalidate_books(asins: set[str], audible_region: audible_region_type):
+    asins = asins - _refreshing_books
+    if not asins:
+        return
+    _refreshing_books.update(asins)
+    run_in_background(_refresh_books(asins, audible_region))
 
-    # clean up cache slightly
-    for k in list(search_cache.keys()):
-        if time.time() - search_cache[k].timestamp > REFETCH_TTL:
-            try:
-                del search_cache[k]
-            except KeyError:  # ignore in race conditions
-                pass
 
-    return ordered
+async def _refresh_books(asins: set[str], audible_region: audible_region_type):
+    try:
+        client_session = get_client_session()
+        coros = [
+            get_book_by_asin(client_session, asin, audible_region) for asin in asins
+        ]
+        new_books = [b for b in await asyncio.gather(*coros) if b]
+        with open_session() as session:
+            store_new_books(session, new_books, audible_region)
+        logger.debug("Refreshed %d stale books", len(new_books))
+    finally:
+        _refreshing_books.difference_update(asins)
 
 
-def get_existing_books(session: Session, asins: set[str]) -> dict[str, BookRequest]:
-    books = list(
-        session.exec(
-            select(BookRequest).where(
-                col(BookRequest.asin).in_(asins),
+# sqlite limits the amount of variables in a single statement. Older builds allow only 999
+_UPSERT_CHUNK_SIZE = 999 // len(BookMetadata.model_fields)
+
+
+def _upsert_books(session: Session, books: list[BookMetadata]):
+    """Inserts the books or replaces the stored ones with a single statement per chunk"""
+    for i in range(0, len(books), _UPSERT_CHUNK_SIZE):
+        chunk = books[i : i + _UPSERT_CHUNK_SIZE]
+        stmt = insert(BookMetadata).values([b.model_dump() for b in chunk])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["asin", "region"],
+            set_={c.name: c for c in stmt.excluded if c.name not in ("asin", "region")},
+        )
+        session.connection().execute(stmt)
+
+
+def _flush_books(books: list[BookMetadata]):
+    with open_session() as session:
+        _upsert_books(session, books)
+        session.commit()
+
+
+# with a delay, the books of concurrent searches are written in a single transaction
+metadata_writer = WriteBehind[tuple[str, str], BookMetadata](
+    _flush_books, Settings().search.write_behind_delay
+)
+
+
+def store_new_books(
+    session: Session,
+    books: list[BookRequest],
+    audible_region: audible_region_type = "us",
+):
+    """Stores the fetched book details in the metadata table, replacing older entries"""
+    metadata = [BookMetadata.from_book(b, audible_region) for b in books]
+    if metadata_writer.delay > 0:
+        for m in metadata:
+            metadata_writer.put((m.asin, m.region), m)
+    elif metadata:
+        _upsert_books(session, metadata)
+        session.commit()
+
+    if _stored_titles_index is not None:
+        for b in books:
+            _stored_titles_index.add(b.title)
+
+    prewarm_covers(books)
+
+
+# books are refreshed this long before they expire
+REFRESH_AHEAD = 60 * 60 * 24  # 1 day
+# seconds without searches after which the background refresh starts
+REFRESH_IDLE_TIME = 60
+
+
+def _get_expiring_books(
+    session: Session, limit: int
+) -> list[tuple[str, audible_region_type]]:
+    """
+    Returns the (asin, region) of stored books that expire soon. Requested books come first,
+    ordered by the amount of requests. Unrequested books are skipped once too old to be shown.
+    """
+    now = time.time()
+    rows = session.connection().execute(
+        text(
+            """
+            SELECT asin, region, fetched_at, requests FROM (
+                SELECT m.asin, m.region, m.fetched_at,
+                    (SELECT count(*) FROM bookrequest r WHERE r.asin = m.asin) AS requests
+                FROM bookmetadata m WHERE m.fetched_at < :expiring
+            ) WHERE requests > 0 OR fetched_at >= :oldest
+            UNION ALL
+            SELECT asin, 'us', min(updated_at), count(*) FROM bookrequest r
+            WHERE updated_at < :expiring AND NOT EXISTS (
+                SELECT 1 FROM bookmetadata m WHERE m.asin = r.asin
             )
-        ).all()
+            GROUP BY asin
+            ORDER BY requests DESC, fetched_at ASC
+            LIMIT :limit
+            """
+        ),
+        {
+            "expiring": datetime.fromtimestamp(now - REFETCH_TTL + REFRESH_AHEAD),
+            "oldest": datetime.fromtimestamp(now - REFETCH_TTL - MAX_STALENESS),
+            "limit": limit,
+        },
     )
+    return [(row[0], row[1]) for row in rows]
 
-    ok_books: list[BookRequest] = []
-    for b in books:
-        if b.updated_at.timestamp() + REFETCH_TTL < time.time():
-            continue
-        ok_books.append(b)
 
-    return {b.asin: b for b in ok_books}
+async def _refresh_book_conditionally(
+    client_session: ClientSession,
+    asin: str,
+    audible_region: audible_region_type,
+) -> tuple[bool, Optional[BookRequest]]:
+    """
+    Asks the metadata providers in order of their health. Returns if the book is unchanged
+    since the last request to a provider and the updated book otherwise.
+    """
+    for provider in metadata_router.ranked(audible_region):
+        try:
+            book = await _get_provider_book(
+                client_session, provider, asin, audible_region, conditional=True
+            )
+        except NotModified:
+            return True, None
+        except ClientError as e:
+            logger.debug("Failed to refresh book %s from %s: %s", asin, provider, e)
+            continue
+        except Exception as e:
+            # a failing book must not abort the refresh of the whole batch
+            logger.warning("Failed to refresh book %s from %s: %s", asin, provider, e)
+            continue
+        if book:
+            return False, book
+    return False, None
+
+
+def _update_requested_books(
+    session: Session, books: list[BookRequest], unchanged: set[str]
+):
+    """Keeps the details of requested books up to date with the refreshed metadata"""
+    by_asin = {b.asin: b for b in books}
+    requests = session.exec(
+        select(BookRequest).where(col(BookRequest.asin).in_(by_asin.keys() | unchanged))
+    ).all()
+    for request in requests:
+        if book := by_asin.get(request.asin):
+            request.title = book.title
+            request.subtitle = book.subtitle
+            request.authors = book.authors
+            request.narrators = book.narrators
+            request.cover_image = book.cover_image
+            request.release_date = book.release_date
+            request.runtime_length_min = book.runtime_length_min
+        request.updated_at = datetime.now()
+        session.add(request)
+    session.commit()
 
 
-def store_new_books(session: Session, books: list[BookRequest]):
-    assert all(b.user_username is None for b in books)
-    asins = {b.asin: b for b in books}
+async def refresh_expiring_books(batch_size: int):
+    """
+    Refreshes books that are about to expire in batches, as long as no user is searching.
+    The governor of each upstream limits the rate of the requests.
+    """
+    client_session = get_client_session()
+    refreshed = 0
+    while True:
+        idle = time.time() - _last_activity
+        if idle < REFRESH_IDLE_TIME:
+            await asyncio.sleep(REFRESH_IDLE_TIME - idle)
+            continue
 
-    existing = list(
-        session.exec(
-            select(BookRequest).where(
-                col(BookRequest.asin).in_(asins.keys()),
-                col(BookRequest.user_username).is_(None),
+        with open_session() as session:
+            # books that are currently refreshed because of a search are skipped
+            expiring = [
+                book
+                for book in _get_expiring_books(session, batch_size)
+                if book[0] not in _refreshing_books
+            ]
+        if not expiring:
+            break
+
+        results = await asyncio.gather(
+            *[
+                _refresh_book_conditionally(client_session, asin, region)
+                for asin, region in expiring
+            ]
+        )
+
+        with open_session() as session:
+            unchanged: set[str] = set()
+            books_by_region: dict[audible_region_type, list[BookRequest]] = {}
+            now = datetime.now()
+            for (asin, region), (not_modified, book) in zip(expiring, results):
+                if not_modified:
+                    unchanged.add(asin)
+                    metadata = session.get(BookMetadata, (asin, region))
+                    if metadata:
+                        metadata.fetched_at = now
+                        session.add(metadata)
+                elif book:
+                    books_by_region.setdefault(region, []).append(book)
+            session.commit()
+            for region, books in books_by_region.items():
+                store_new_books(session, books, region)
+            _update_requested_books(
+                session,
+                [b for books in books_by_region.values() for b in books],
+                unchanged,
             )
-        ).all()
+
+        done = len(unchanged) + sum(len(b) for b in books_by_region.values())
+        refreshed += done
+        if done == 0:
+            # every provider failed, try again in the next run
+            break
+
+    if refreshed:
+        logger.info("Refreshed %d books in the background", refreshed)
+
+
+async def refresh_books_periodically():
+    interval = Settings().search.refresh_interval
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await refresh_expiring_books(Settings().search.refresh_batch_size)
+        except Exception as e:
+            logger.error("Background refresh of books failed: %s", e)
+
+
+def _fts_query(query: str) -> Optional[str]:
+    """Turns a user query into a FTS5 query that matches all words as prefixes"""
+    words: list[str] = re.findall(r"\w+", query)
+    if not words:
+        return None
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def search_local_asins(
+    session: Session,
+    query: str,
+    limit: int = -1,
+    offset: int = 0,
+) -> list[str]:
+    """
+    Searches the full-text index of all stored books, ordered by relevance.
+    Title matches weigh more than subtitle, author and narrator matches.
+    """
+    fts_query = _fts_query(query)
+    if not fts_query:
+        return []
+    rows = session.connection().execute(
+        text(
+            """
+            SELECT asin FROM book_fts WHERE book_fts MATCH :query
+            ORDER BY bm25(book_fts, 0, 10, 5, 2, 1)
+            LIMIT :limit OFFSET :offset
+            """
+        ),
+        {"query": fts_query, "limit": limit, "offset": offset},
     )
+    return [row[0] for row in rows]
 
-    to_update: list[BookRequest] = []
-    for b in existing:
-        new_book = asins[b.asin]
-        b.title = new_book.title
-        b.subtitle = new_book.subtitle
-        b.authors = new_book.authors
-        b.narrators = new_book.narrators
-        b.cover_image = new_book.cover_image
-        b.release_date = new_book.release_date
-        b.runtime_length_min = new_book.runtime_length_min
-        to_update.append(b)
-
-    existing_asins = {b.asin for b in existing}
-    to_add = [b for b in books if b.asin not in existing_asins]
-    session.add_all(to_add + existing)
-    session.commit()
+
+def search_local_books(
+    session: Session,
+    query: str,
+    num_results: int = 20,
+    page: int = 0,
+) -> list[BookRequest]:
+    """Search mode that does not depend on Audible by only using already stored books"""
+    asins = search_local_asins(session, query, num_results, page * num_results)
+
+    # the most recently fetched region wins if a book is stored for multiple regions
+    by_asin: dict[str, BookRequest] = {}
+    metadata = session.exec(
+        select(BookMetadata)
+        .where(col(BookMetadata.asin).in_(asins))
+        .order_by(col(BookMetadata.fetched_at))
+    ).all()
+    for m in metadata:
+        by_asin[m.asin] = m.to_book_request()
+
+    # manually added books or books whose metadata has been pruned
+    missing = [asin for asin in asins if asin not in by_asin]
+    if missing:
+        for b in session.exec(
+            select(BookRequest).where(col(BookRequest.asin).in_(missing))
+        ).all():
+            by_asin.setdefault(b.asin, b)
+    return [by_asin[asin] for asin in asins if asin in by_asin]
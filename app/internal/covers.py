@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Optional
+
+from aiohttp import ClientError, ClientSession
+from sqlmodel import Session, col, select
+
+from app.internal.env_settings import Settings
+from app.internal.models import BookMetadata, BookRequest
+from app.util.background import run_in_background
+from app.util.cache import SimpleCache
+from app.util.connection import get_client_session
+from app.util.governor import get_upstream
+from app.util.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# covers are shown at most 10rem wide, this leaves room for high density screens
+COVER_SIZE = 320
+
+cover_dir = Path(Settings().app.config_dir) / "covers"
+cover_flight = SingleFlight[str, Optional[Path]]()
+# covers that could not be downloaded are not retried on every page view
+FAILED_COVER_TTL = 10 * 60
+failed_cover_cache = SimpleCache[bool](max_size=1000)
+# prewarming covers should not take away too many connections from searches
+_prewarm_semaphore = asyncio.Semaphore(4)
+
+# amazon image urls like https://m.media-amazon.com/images/I/51xyz._SL500_.jpg
+_amazon_image_re = re.compile(
+    r"^(?P<base>https://m\.media-amazon\.com/images/I/[^./]+)(\._[^/]*_)?\.(jpg|jpeg|png)$"
+)
+
+
+def thumbnail_url(url: str, size: int = COVER_SIZE) -> str:
+    """
+    Amazon's image CDN resizes images when the size is part of the URL.
+    Other URLs are returned unchanged.
+    """
+    if match := _amazon_image_re.match(url):
+        return f"{match.group('base')}._SL{size}_.jpg"
+    return url
+
+
+# covers are stored with the extension of their content type
+_cover_extensions = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+    "image/avif": ".avif",
+}
+_cover_content_types = {ext: ct for ct, ext in _cover_extensions.items()}
+
+
+def cover_path(asin: str) -> Optional[Path]:
+    """The path of the stored cover, if it has already been downloaded"""
+    if not asin.isalnum():
+        return None
+    for extension in _cover_extensions.values():
+        path = cover_dir / f"{asin}{extension}"
+        if path.exists():
+            return path
+    return None
+
+
+def cover_content_type(path: Path) -> str:
+    return _cover_content_types.get(path.suffix, "image/jpeg")
+
+
+def get_cover_image_url(session: Session, asin: str) -> Optional[str]:
+    cover_image = session.exec(
+        select(BookMetadata.cover_image).where(
+            BookMetadata.asin == asin, col(BookMetadata.cover_image).is_not(None)
+        )
+    ).first()
+    if cover_image:
+        return cover_image
+    return session.exec(
+        select(BookRequest.cover_image).where(
+            BookRequest.asin == asin, col(BookRequest.cover_image).is_not(None)
+        )
+    ).first()
+
+
+async def get_cover(
+    client_session: ClientSession, asin: str, url: str
+) -> Optional[Path]:
+    """Returns the path of the stored thumbnail. Covers are only downloaded once."""
+    if not asin.isalnum():
+        return None
+    if path := cover_path(asin):
+        return path
+    if failed_cover_cache.get(FAILED_COVER_TTL, asin):
+        return None
+    path = await cover_flight.do(
+        asin, lambda: _download_cover(client_session, asin, url)
+    )
+    if path is None:
+        failed_cover_cache.set(True, asin)
+    return path
+
+
+async def _download_cover(
+    client_session: ClientSession, asin: str, url: str
+) -> Optional[Path]:
+    try:
+        async with get_upstream("covers").get(
+            client_session, thumbnail_url(url)
+        ) as response:
+            extension = _cover_extensions.get(response.content_type)
+            if not response.ok or extension is None:
+                logger.warning(
+                    "Failed to fetch cover %s: %s: %s (%s)",
+                    url,
+                    response.status,
+                    response.reason,
+                    response.content_type,
+                )
+                return None
+            data = await response.read()
+    except (ClientError, asyncio.TimeoutError) as e:
+        logger.warning("Failed to fetch cover %s: %s", url, e)
+        return None
+
+    path = cover_dir / f"{asin}{extension}"
+    # write to a temporary file first, so a partially written cover is never served
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+def prewarm_covers(books: list[BookRequest]):
+    """Downloads the covers of the books in the background, so they are served from disk"""
+    missing = [
+        (b.asin, b.cover_image)
+        for b in books
+        if b.cover_image
+        and b.asin.isalnum()
+        and not cover_path(b.asin)
+        and not failed_cover_cache.get(FAILED_COVER_TTL, b.asin)
+    ]
+    if missing:
+        run_in_background(_prewarm_covers(missing))
+
+
+async def _prewarm_covers(covers: list[tuple[str, str]]):
+    client_session = get_client_session()
+
+    async def prewarm(asin: str, url: str):
+        async with _prewarm_semaphore:
+            await get_cover(client_session, asin, url)
+
+    await asyncio.gather(*[prewarm(asin, url) for asin, url in covers])
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from aiohttp import ClientError
+from sqlmodel import Session, col, select
+
+from app.internal.env_settings import Settings
+from app.internal.models import (
+    BookRequest,
+    DownloadJob,
+    DownloadJobStatus,
+    EventEnum,
+)
+from app.internal.notifications import send_all_notifications
+from app.internal.prowlarr.prowlarr import ProwlarrMisconfigured, start_download
+from app.util.connection import get_client_session
+from app.util.db import open_session
+
+logger = logging.getLogger(__name__)
+
+# set whenever a job is queued, so idle workers pick it up immediately
+_job_queued = asyncio.Event()
+
+
+def enqueue_download(
+    session: Session,
+    guid: str,
+    indexer_id: int,
+    book_asin: str,
+    requester_username: Optional[str],
+) -> DownloadJob:
+    """
+    Queues the release to be sent to the download client. A release that has already
+    been queued is not queued again, unless its previous download failed.
+    """
+    job = session.exec(select(DownloadJob).where(DownloadJob.guid == guid)).first()
+    if job and job.status != DownloadJobStatus.failed:
+        return job
+
+    if job is None:
+        job = DownloadJob(
+            guid=guid,
+            indexer_id=indexer_id,
+            book_asin=book_asin,
+            requester_username=requester_username,
+        )
+    else:
+        job.status = DownloadJobStatus.queued
+        job.attempts = 0
+        job.error = None
+        job.next_attempt_at = datetime.now()
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    _job_queued.set()
+    return job
+
+
+def has_pending_download(session: Session, book_asin: str) -> bool:
+    """If a download of the book is queued or being sent to the download client"""
+    return (
+        session.exec(
+            select(DownloadJob.id).where(
+                DownloadJob.book_asin == book_asin,
+                col(DownloadJob.status).in_(
+                    [DownloadJobStatus.queued, DownloadJobStatus.running]
+                ),
+            )
+        ).first()
+        is not None
+    )
+
+
+def _claim_job(session: Session) -> Optional[DownloadJob]:
+    # jobs are claimed without awaiting in between, so no two workers get the same job
+    job = session.exec(
+        select(DownloadJob)
+        .where(
+            DownloadJob.status == DownloadJobStatus.queued,
+            col(DownloadJob.next_attempt_at) <= datetime.now(),
+        )
+        .order_by(col(DownloadJob.next_attempt_at))
+    ).first()
+    if job:
+        job.status = DownloadJobStatus.running
+        job.attempts += 1
+        session.add(job)
+        session.commit()
+    return job
+
+
+def _get_next_attempt_in(session: Session) -> Optional[float]:
+    next_attempt_at = session.exec(
+        select(DownloadJob.next_attempt_at)
+        .where(DownloadJob.status == DownloadJobStatus.queued)
+        .order_by(col(DownloadJob.next_attempt_at))
+    ).first()
+    if next_attempt_at is None:
+        return None
+    return max(0, (next_attempt_at - datetime.now()).total_seconds())
+
+
+async def _dispatch(session: Session, job: DownloadJob):
+    settings = Settings().download
+    error_status: Optional[int] = None
+    try:
+        response = await start_download(
+            session, get_client_session(), job.guid, job.indexer_id
+        )
+        if response.ok:
+            job.status = DownloadJobStatus.succeeded
+            job.error = None
+        else:
+            error_status = response.status
+            job.error = response.reason or "<unknown>"
+    except (ClientError, asyncio.TimeoutError, ProwlarrMisconfigured) as e:
+        job.error = str(e) or type(e).__name__
+
+    # client errors like an unknown release will not succeed when retried
+    retry = error_status is None or error_status >= 500 or error_status == 429
+    if job.status != DownloadJobStatus.succeeded:
+        if retry and job.attempts < settings.max_attempts:
+            job.status = DownloadJobStatus.queued
+            backoff = settings.retry_backoff * 2 ** (job.attempts - 1)
+            job.next_attempt_at = datetime.now() + timedelta(seconds=backoff)
+            logger.warning(
+                "Failed to start download for %s (attempt %d), retrying in %ds: %s",
+                job.guid,
+                job.attempts,
+                backoff,
+                job.error,
+            )
+        else:
+            job.status = DownloadJobStatus.failed
+            logger.error("Failed to start download for %s: %s", job.guid, job.error)
+    session.add(job)
+
+    if job.status == DownloadJobStatus.succeeded:
+        books = session.exec(
+            select(BookRequest).where(BookRequest.asin == job.book_asin)
+        ).all()
+        for book in books:
+            book.downloaded = True
+            session.add(book)
+    session.commit()
+
+    if job.status == DownloadJobStatus.succeeded:
+        await send_all_notifications(
+            EventEnum.on_successful_download, job.requester_username, job.book_asin
+        )
+    elif job.status == DownloadJobStatus.failed:
+        await send_all_notifications(
+            EventEnum.on_failed_download,
+            job.requester_username,
+            job.book_asin,
+            {
+                "errorStatus": str(error_status) if error_status else "",
+                "errorReason": job.error or "<unknown>",
+            },
+        )
+
+
+async def _work():
+    while True:
+        with open_session() as session:
+            job = _claim_job(session)
+            if job:
+                try:
+                    await _dispatch(session, job)
+                except Exception as e:
+                    logger.error("Download job %s failed: %s", job.id, e)
+                    session.rollback()
+                    session.refresh(job)
+                    if job.status == DownloadJobStatus.running:
+                        job.status = DownloadJobStatus.failed
+                        job.error = str(e)
+                        session.add(job)
+                        session.commit()
+                continue
+            # wait for a new job or the next retry
+            _job_queued.clear()
+            timeout = _get_next_attempt_in(session)
+        try:
+            await asyncio.wait_for(_job_queued.wait(), timeout)
+        except TimeoutError:
+            pass
+
+
+async def run_download_workers():
+    """
+    Sends queued downloads to the download client, `Settings().download.workers`
+    at a time. Jobs that were interrupted by a restart are queued again.
+    """
+    with open_session() as session:
+        interrupted = session.exec(
+            select(DownloadJob).where(DownloadJob.status == DownloadJobStatus.running)
+        ).all()
+        for job in interrupted:
+            job.status = DownloadJobStatus.queued
+            session.add(job)
+        session.commit()
+
+    await asyncio.gather(*[_work() for _ in range(Settings().download.workers)])
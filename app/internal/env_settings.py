@@ -8,6 +8,98 @@ class DBSettings(BaseModel):
     """Relative path to the sqlite database given the config directory. If absolute, it ignores the config dir location."""
 
 
+class CacheSettings(BaseModel):
+    sqlite_path: str = "cache.sqlite"
+    """Relative path to the sqlite cache database given the config directory. If absolute, it ignores the config dir location."""
+    max_entries: int = 10_000
+    """Maximum amount of cached entries before the least recently used ones are evicted."""
+    max_size_mb: int = 100
+    """Maximum size of all cached values in megabytes before the least recently used ones are evicted."""
+    expire_interval: int = 15 * 60
+    """Interval in seconds in which expired cache entries are removed in the background."""
+    max_source_queries: int = 100
+    """Maximum amount of Prowlarr searches whose sources are kept in memory."""
+    persist_sources: bool = True
+    """Store the raw Prowlarr responses compressed in the cache database, so sources survive restarts."""
+
+
+class HttpSettings(BaseModel):
+    max_connections: int = 100
+    """Maximum amount of simultaneous outgoing connections."""
+    max_connections_per_host: int = 10
+    """Maximum amount of simultaneous outgoing connections to a single host."""
+    dns_cache_ttl: int = 300
+    """Time in seconds DNS lookups are cached for."""
+    keepalive_timeout: int = 30
+    """Time in seconds idle connections are kept open for reuse."""
+
+
+class UpstreamSettings(BaseModel):
+    rate: float = 5
+    """Maximum amount of requests per second. Unlimited with 0."""
+    burst: int = 10
+    """Amount of requests that can be sent at once before the rate limit applies."""
+    max_in_flight: int = 8
+    """Maximum amount of concurrent requests."""
+    max_retries: int = 2
+    """Amount of times a throttled or overloaded request is retried."""
+    failure_threshold: int = 5
+    """Consecutive failures after which requests are stopped for `open_seconds`."""
+    open_seconds: int = 60
+    """Time in seconds requests are stopped after too many failures."""
+
+
+class GovernorSettings(BaseModel):
+    audible: UpstreamSettings = UpstreamSettings(max_in_flight=10)
+    audimeta: UpstreamSettings = UpstreamSettings()
+    audnexus: UpstreamSettings = UpstreamSettings(rate=1.5)
+    prowlarr: UpstreamSettings = UpstreamSettings(rate=0, max_in_flight=10)
+    """Prowlarr itself rate limits the indexers."""
+    mam: UpstreamSettings = UpstreamSettings(rate=0.5, burst=2, max_in_flight=1)
+    covers: UpstreamSettings = UpstreamSettings(rate=0)
+    """Cover images are served by a CDN."""
+
+
+class SearchSettings(BaseModel):
+    catalog_metadata: bool = True
+    """Build search results from the Audible catalog response instead of requesting every book from a metadata provider."""
+    max_staleness: int = 7 * 24 * 60 * 60
+    """Time in seconds expired book metadata and search results are still served while they are refreshed in the background."""
+    prefetch_depth: int = 0
+    """Amount of following search result pages that are fetched in the background after a search. Disabled with 0."""
+    write_behind_delay: float = 0
+    """Time in seconds fetched book metadata is collected before it is written to the database in one transaction. Disabled with 0."""
+    refresh_interval: int = 60 * 60
+    """Interval in seconds in which book metadata that expires soon is refreshed in the background. Disabled with 0."""
+    refresh_batch_size: int = 20
+    """Amount of books that are refreshed at once in the background."""
+
+
+class SweeperSettings(BaseModel):
+    interval: int = 30 * 60
+    """Interval in seconds in which requested books that have not been downloaded yet are searched again. Disabled with 0."""
+    batch_size: int = 10
+    """Amount of books that are searched for in every interval."""
+    min_backoff: int = 60 * 60
+    """Time in seconds until a book is searched again after its first unsuccessful search. Doubles with every further search."""
+    max_backoff: int = 7 * 24 * 60 * 60
+    """Maximum time in seconds between two searches of the same book."""
+
+
+class RssSettings(BaseModel):
+    interval: int = 0
+    """Interval in seconds in which new releases in the feeds of all indexers are matched against the wishlist. Disabled with 0."""
+
+
+class DownloadSettings(BaseModel):
+    workers: int = 2
+    """Amount of downloads that are sent to Prowlarr at the same time."""
+    max_attempts: int = 5
+    """Amount of times a download is sent to Prowlarr before it is marked as failed."""
+    retry_backoff: int = 30
+    """Time in seconds until a failed download is retried. Doubles with every further attempt."""
+
+
 class ApplicationSettings(BaseModel):
     debug: bool = False
     openapi_enabled: bool = False
@@ -26,9 +118,21 @@ class Settings(BaseSettings):
     )
 
     db: DBSettings = DBSettings()
+    cache: CacheSettings = CacheSettings()
+    http: HttpSettings = HttpSettings()
+    governor: GovernorSettings = GovernorSettings()
+    search: SearchSettings = SearchSettings()
+    sweeper: SweeperSettings = SweeperSettings()
+    rss: RssSettings = RssSettings()
+    download: DownloadSettings = DownloadSettings()
     app: ApplicationSettings = ApplicationSettings()
 
     def get_sqlite_path(self):
         if self.db.sqlite_path.startswith("/"):
             return self.db.sqlite_path
         return str(pathlib.Path(self.app.config_dir) / self.db.sqlite_path)
+
+    def get_cache_path(self):
+        if self.cache.sqlite_path.startswith("/"):
+            return self.cache.sqlite_path
+        return str(pathlib.Path(self.app.config_dir) / self.cache.sqlite_path)
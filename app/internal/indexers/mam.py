@@ -16,6 +16,7 @@ from app.internal.models import (
     BookRequest,
     ProwlarrSource,
 )
+from app.util.governor import get_upstream
 
 logger = logging.getLogger(__name__)
 
@@ -82,8 +83,8 @@ class MamIndexer(AbstractIndexer[MamConfigurations]):
 
         session_id = configurations.mam_session_id
 
-        async with container.client_session.get(
-            url, cookies={"mam_id": session_id}
+        async with get_upstream("mam").get(
+            container.client_session, url, cookies={"mam_id": session_id}
         ) as response:
             if response.status == 403:
                 logger.error("Mam: Failed to authenticate: %s", await response.text())
@@ -109,6 +109,102 @@ class BookRequest(BaseBook, table=True):
         arbitrary_types_allowed = True
 
 
+class BookMetadata(BaseModel, table=True):
+    """
+    Book details fetched from Audible or the metadata providers. Kept separate
+    from the book requests, so it can be refreshed and pruned on its own.
+    """
+
+    asin: str = Field(primary_key=True)
+    region: str = Field(primary_key=True)
+    title: str
+    subtitle: Optional[str]
+    authors: list[str] = Field(default_factory=list, sa_column=Column(JSON))
+    narrators: list[str] = Field(default_factory=list, sa_column=Column(JSON))
+    cover_image: Optional[str]
+    release_date: datetime
+    runtime_length_min: int
+    fetched_at: datetime = Field(
+        default_factory=datetime.now,
+        sa_column=Column(
+            server_default=func.now(),
+            type_=DateTime,
+            nullable=False,
+            index=True,
+        ),
+    )
+
+    class Config:  # pyright: ignore[reportIncompatibleVariableOverride]
+        arbitrary_types_allowed = True
+
+    @staticmethod
+    def from_book(book: BaseBook, region: str) -> "BookMetadata":
+        return BookMetadata(
+            asin=book.asin,
+            region=region,
+            title=book.title,
+            subtitle=book.subtitle,
+            authors=book.authors,
+            narrators=book.narrators,
+            cover_image=book.cover_image,
+            release_date=book.release_date,
+            runtime_length_min=book.runtime_length_min,
+        )
+
+    def to_book_request(self) -> BookRequest:
+        return BookRequest(
+            asin=self.asin,
+            title=self.title,
+            subtitle=self.subtitle,
+            authors=self.authors,
+            narrators=self.narrators,
+            cover_image=self.cover_image,
+            release_date=self.release_date,
+            runtime_length_min=self.runtime_length_min,
+        )
+
+
+class MissingBookSearch(BaseModel, table=True):
+    """
+    Schedule of the repeated source searches for a requested book that has not been
+    downloaded yet. Every unsuccessful search doubles the time until the next one.
+    """
+
+    asin: str = Field(primary_key=True)
+    attempts: int = 0
+    searched_at: datetime
+    next_search_at: datetime = Field(index=True)
+
+
+class DownloadJobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+
+
+class DownloadJob(BaseModel, table=True):
+    """
+    A release that is sent to Prowlarr by the download workers. Every release is only
+    grabbed once, so the guid is unique.
+    """
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    guid: str = Field(unique=True)
+    indexer_id: int
+    book_asin: str = Field(index=True)
+    requester_username: Optional[str]
+    status: DownloadJobStatus = DownloadJobStatus.queued
+    attempts: int = 0
+    next_attempt_at: datetime = Field(default_factory=datetime.now, index=True)
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.now)
+
+    @property
+    def done(self) -> bool:
+        return self.status in (DownloadJobStatus.succeeded, DownloadJobStatus.failed)
+
+
 class ManualBookRequest(BaseModel, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     user_username: str = Field(foreign_key="user.username", ondelete="CASCADE")
@@ -133,7 +229,7 @@ class ManualBookRequest(BaseModel, table=True):
         arbitrary_types_allowed = True
 
 
-class BookMetadata(BaseModel):
+class SourceBookMetadata(BaseModel):
     """extra metadata that can be added to sources to better rank them"""
 
     title: Optional[str] = None
@@ -155,7 +251,7 @@ class BaseSource(BaseModel):
     download_url: Optional[str] = None
     magnet_url: Optional[str] = None
 
-    book_metadata: BookMetadata = BookMetadata()
+    book_metadata: SourceBookMetadata = SourceBookMetadata()
 
     @property
     def size_MB(self):
@@ -1,10 +1,10 @@
 import logging
 from typing import Optional
 
-from aiohttp import ClientSession
 from sqlmodel import Session, select
 
 from app.internal.models import BookRequest, EventEnum, ManualBookRequest, Notification
+from app.util.connection import get_client_session
 from app.util.db import open_session
 
 logger = logging.getLogger(__name__)
@@ -73,31 +73,61 @@ async def send_notification(
     book_asin: Optional[str] = None,
     other_replacements: dict[str, str] = {},
 ):
-    async with ClientSession() as client_session:
-        book_title = None
-        book_authors = None
-        book_narrators = None
-        if book_asin:
-            book = session.exec(
-                select(BookRequest).where(BookRequest.asin == book_asin)
-            ).first()
-            if book:
-                book_title = book.title
-                book_authors = ",".join(book.authors)
-                book_narrators = ",".join(book.narrators)
+    book_title = None
+    book_authors = None
+    book_narrators = None
+    if book_asin:
+        book = session.exec(
+            select(BookRequest).where(BookRequest.asin == book_asin)
+        ).first()
+        if book:
+            book_title = book.title
+            book_authors = ",".join(book.authors)
+            book_narrators = ",".join(book.narrators)
+
+    title, body = replace_variables(
+        notification.title_template,
+        notification.body_template,
+        requester_username,
+        book_title,
+        book_authors,
+        book_narrators,
+        notification.event.value,
+        other_replacements,
+    )
+
+    async with get_client_session().post(
+        notification.apprise_url,
+        json={
+            "title": title,
+            "body": body,
+        },
+        headers=notification.headers,
+    ) as response:
+        response.raise_for_status()
+        return await response.json()
 
+
+async def send_manual_notification(
+    notification: Notification,
+    book: ManualBookRequest,
+    requester_username: Optional[str] = None,
+    other_replacements: dict[str, str] = {},
+):
+    """Send a notification for manual book requests"""
+    try:
         title, body = replace_variables(
             notification.title_template,
             notification.body_template,
             requester_username,
-            book_title,
-            book_authors,
-            book_narrators,
+            book.title,
+            ",".join(book.authors),
+            ",".join(book.narrators),
             notification.event.value,
             other_replacements,
         )
 
-        async with client_session.post(
+        async with get_client_session().post(
             notification.apprise_url,
             json={
                 "title": title,
@@ -107,38 +137,6 @@ async def send_notification(
         ) as response:
             response.raise_for_status()
             return await response.json()
-
-
-async def send_manual_notification(
-    notification: Notification,
-    book: ManualBookRequest,
-    requester_username: Optional[str] = None,
-    other_replacements: dict[str, str] = {},
-):
-    """Send a notification for manual book requests"""
-    try:
-        async with ClientSession() as client_session:
-            title, body = replace_variables(
-                notification.title_template,
-                notification.body_template,
-                requester_username,
-                book.title,
-                ",".join(book.authors),
-                ",".join(book.narrators),
-                notification.event.value,
-                other_replacements,
-            )
-
-            async with client_session.post(
-                notification.apprise_url,
-                json={
-                    "title": title,
-                    "body": body,
-                },
-                headers=notification.headers,
-            ) as response:
-                response.raise_for_status()
-                return await response.json()
     except Exception as e:
         logger.error("Failed to send notification", e)
         return None
@@ -1,24 +1,36 @@
+import asyncio
 import json
 import logging
 import posixpath
 from datetime import datetime
-from typing import Any, Literal, Optional
+from typing import Any, AsyncGenerator, Literal, Optional
 from urllib.parse import urlencode
 
-from aiohttp import ClientResponse, ClientSession
+import pydantic
+from aiohttp import ClientError, ClientResponse, ClientSession
+from rapidfuzz import fuzz, utils
 from sqlmodel import Session
 
+from app.internal.env_settings import Settings
 from app.internal.indexers.abstract import SessionContainer
+from app.internal.indexers.indexer_util import IndexerContext
 from app.internal.models import (
     BookRequest,
-    EventEnum,
     ProwlarrSource,
     TorrentSource,
     UsenetSource,
 )
-from app.internal.notifications import send_all_notifications
-from app.internal.prowlarr.source_metadata import edit_source_metadata
+from app.internal.prowlarr.source_metadata import (
+    edit_source_metadata,
+    edit_sources,
+    setup_indexers,
+)
+from app.internal.prowlarr.query_variants import get_query_variants, short_title
+from app.internal.ranking.quality import quality_config
 from app.util.cache import SimpleCache, StringConfigCache
+from app.util.governor import get_upstream
+from app.util.db import open_session
+from app.util.persistent_cache import PersistentCache
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +44,10 @@ ProwlarrConfigKey = Literal[
     "prowlarr_base_url",
     "prowlarr_source_ttl",
     "prowlarr_categories",
+    "prowlarr_parallel_search",
+    "prowlarr_indexer_timeout",
+    "prowlarr_max_results",
+    "prowlarr_query_expansion",
 ]
 
 
@@ -78,13 +94,126 @@ class ProwlarrConfig(StringConfigCache[ProwlarrConfigKey]):
     def set_categories(self, session: Session, categories: list[int]):
         self.set(session, "prowlarr_categories", json.dumps(categories))
 
+    def get_parallel_search(self, session: Session) -> bool:
+        return bool(self.get_int(session, "prowlarr_parallel_search", 0))
+
+    def set_parallel_search(self, session: Session, parallel_search: bool):
+        self.set_int(session, "prowlarr_parallel_search", int(parallel_search))
+
+    def get_indexer_timeout(self, session: Session) -> int:
+        return self.get_int(session, "prowlarr_indexer_timeout", 15)
+
+    def set_indexer_timeout(self, session: Session, indexer_timeout: int):
+        self.set_int(session, "prowlarr_indexer_timeout", indexer_timeout)
+
+    def get_max_results(self, session: Session) -> int:
+        return self.get_int(session, "prowlarr_max_results", PAGE_SIZE)
+
+    def set_max_results(self, session: Session, max_results: int):
+        self.set_int(session, "prowlarr_max_results", max_results)
+
+    def get_query_expansion(self, session: Session) -> bool:
+        return bool(self.get_int(session, "prowlarr_query_expansion", 0))
+
+    def set_query_expansion(self, session: Session, query_expansion: bool):
+        self.set_int(session, "prowlarr_query_expansion", int(query_expansion))
+
+
+# prowlarr returns at most this many results per request
+PAGE_SIZE = 100
+# amount of further pages that are requested at the same time
+PAGE_CONCURRENCY = 3
 
 prowlarr_config = ProwlarrConfig()
-prowlarr_source_cache = SimpleCache[list[ProwlarrSource]]()
+
+
+class SourceQuery(pydantic.BaseModel, frozen=True):
+    asin: str
+    queries: tuple[str, ...]
+    categories: tuple[int, ...]
+    indexer_ids: Optional[tuple[int, ...]]
+
+    @staticmethod
+    def create(
+        asin: str,
+        queries: list[str],
+        categories: list[int],
+        indexer_ids: Optional[list[int]],
+    ) -> "SourceQuery":
+        return SourceQuery(
+            asin=asin,
+            queries=tuple(" ".join(query.lower().split()) for query in queries),
+            categories=tuple(sorted(categories)),
+            indexer_ids=tuple(sorted(indexer_ids)) if indexer_ids is not None else None,
+        )
+
+
+# ranked sources with additional metadata of the most recent searches
+prowlarr_source_cache = SimpleCache[list[ProwlarrSource]](
+    max_size=Settings().cache.max_source_queries
+)
+
+
+def _get_response_ttl() -> int:
+    with open_session() as session:
+        return prowlarr_config.get_source_ttl(session)
+
+
+# raw prowlarr responses, so sources don't have to be searched again after a restart.
+# They expire with the source ttl configured by the admin
+prowlarr_response_cache = PersistentCache[SourceQuery, list[dict[str, Any]]](
+    "prowlarr_responses", _get_response_ttl, compress=True
+)
+
+
+class ProwlarrIndexer(pydantic.BaseModel):
+    id: int
+    name: str
+    protocol: str
+
+
+# indexers rarely change, so they are only refetched every few minutes
+INDEXER_TTL = 10 * 60
+prowlarr_indexer_cache = SimpleCache[list[ProwlarrIndexer]]()
 
 
 def flush_prowlarr_cache():
     prowlarr_source_cache.flush()
+    prowlarr_response_cache.flush()
+    prowlarr_indexer_cache.flush()
+
+
+async def get_enabled_indexers(
+    session: Session, client_session: ClientSession
+) -> list[ProwlarrIndexer]:
+    """
+    https://prowlarr.com/docs/api/#/Indexer/get_api_v1_indexer
+    """
+    base_url = prowlarr_config.get_base_url(session)
+    api_key = prowlarr_config.get_api_key(session)
+    assert base_url is not None and api_key is not None
+
+    cached_indexers = prowlarr_indexer_cache.get(INDEXER_TTL, base_url)
+    if cached_indexers is not None:
+        return cached_indexers
+
+    async with get_upstream("prowlarr").get(
+        client_session,
+        posixpath.join(base_url, "api/v1/indexer"),
+        headers={"X-Api-Key": api_key},
+    ) as response:
+        response.raise_for_status()
+        results = await response.json()
+
+    indexers = [
+        ProwlarrIndexer(
+            id=result["id"], name=result["name"], protocol=result["protocol"]
+        )
+        for result in results
+        if result.get("enable")
+    ]
+    prowlarr_indexer_cache.set(indexers, base_url)
+    return indexers
 
 
 async def start_download(
@@ -92,9 +221,11 @@ async def start_download(
     client_session: ClientSession,
     guid: str,
     indexer_id: int,
-    requester_username: str,
-    book_asin: str,
 ) -> ClientResponse:
+    """
+    Sends the release to the download client. Downloads should be started through
+    the download queue, which retries failed downloads and sends the notifications.
+    """
     prowlarr_config.raise_if_invalid(session)
     base_url = prowlarr_config.get_base_url(session)
     api_key = prowlarr_config.get_api_key(session)
@@ -102,73 +233,375 @@ async def start_download(
 
     url = posixpath.join(base_url, "api/v1/search")
     logger.debug("Starting download for %s", guid)
-    async with client_session.post(
+    # the grab might have been accepted even if the response failed. Only the download
+    # queue retries it, so it is not sent to the download client twice
+    async with get_upstream("prowlarr").post(
+        client_session,
         url,
+        max_retries=0,
         json={"guid": guid, "indexerId": indexer_id},
         headers={"X-Api-Key": api_key},
     ) as response:
         if not response.ok:
             logger.error("Failed to start download for %s: %s", guid, response)
-            await send_all_notifications(
-                EventEnum.on_failed_download,
-                requester_username,
-                book_asin,
-                {
-                    "errorStatus": str(response.status),
-                    "errorReason": response.reason or "<unknown>",
-                },
-            )
         else:
             logger.debug("Download successfully started for %s", guid)
-            await send_all_notifications(
-                EventEnum.on_successful_download, requester_username, book_asin
-            )
 
         return response
 
 
+def _get_source_query(
+    session: Session, book_request: BookRequest, indexer_ids: Optional[list[int]]
+) -> SourceQuery:
+    if prowlarr_config.get_query_expansion(session):
+        queries = get_query_variants(book_request)
+    else:
+        queries = [book_request.title]
+    return SourceQuery.create(
+        book_request.asin,
+        queries,
+        prowlarr_config.get_categories(session),
+        indexer_ids,
+    )
+
+
+async def _get_cache_keys(
+    session: Session, client_session: ClientSession, book_request: BookRequest
+) -> dict[Optional[int], str]:
+    """
+    Keys of the source cache that the next search for the book looks up. If every
+    indexer is searched separately, there is one key per indexer.
+    """
+    if not prowlarr_config.get_parallel_search(session):
+        cache_key = _get_source_query(session, book_request, None)
+        return {None: cache_key.model_dump_json()}
+    indexers = await get_enabled_indexers(session, client_session)
+    return {
+        indexer.id: _get_source_query(
+            session, book_request, [indexer.id]
+        ).model_dump_json()
+        for indexer in indexers
+    }
+
+
+async def cache_sources(
+    session: Session,
+    client_session: ClientSession,
+    book_request: BookRequest,
+    sources: list[ProwlarrSource],
+):
+    """
+    Stores sources that were found for the book in another way,
+    so the next search for the book does not have to query prowlarr again.
+    """
+    cache_keys = await _get_cache_keys(session, client_session, book_request)
+    for indexer_id, cache_key in cache_keys.items():
+        prowlarr_source_cache.set(
+            [s for s in sources if indexer_id is None or s.indexer_id == indexer_id],
+            cache_key,
+        )
+
+
+async def get_cached_sources(
+    session: Session, client_session: ClientSession, book_request: BookRequest
+) -> Optional[list[ProwlarrSource]]:
+    """The cached sources of the book, or None if the next search would not be cached"""
+    source_ttl = prowlarr_config.get_source_ttl(session)
+    sources: list[ProwlarrSource] = []
+    for cache_key in (
+        await _get_cache_keys(session, client_session, book_request)
+    ).values():
+        cached_sources = prowlarr_source_cache.get(source_ttl, cache_key)
+        if cached_sources is None:
+            return None
+        sources += cached_sources
+    return sources
+
+
+async def query_prowlarr_broad(
+    session: Session,
+    client_session: ClientSession,
+    query: str,
+    titles: list[str],
+) -> list[ProwlarrSource]:
+    """
+    Searches for a query that covers multiple books, like the name of an author.
+    `titles` are the books that are searched for and are used to decide when to
+    stop fetching further results. The sources are neither cached nor enriched
+    with additional metadata, as that depends on the book they belong to.
+    """
+    base_url = prowlarr_config.get_base_url(session)
+    api_key = prowlarr_config.get_api_key(session)
+    assert base_url is not None and api_key is not None
+
+    params: dict[str, Any] = {"query": query, "type": "search"}
+    categories = prowlarr_config.get_categories(session)
+    if len(categories) > 0:
+        params["categories"] = categories
+
+    search_results = await _fetch_search_results(
+        session, client_session, titles, base_url, api_key, params
+    )
+    return parse_sources(search_results)
+
+
 async def query_prowlarr(
     session: Session,
     client_session: ClientSession,
     book_request: BookRequest,
     indexer_ids: Optional[list[int]] = None,
     force_refresh: bool = False,
+    indexer_setup: Optional[asyncio.Task[list[IndexerContext]]] = None,
 ) -> list[ProwlarrSource]:
-    query = book_request.title
-
+    """
+    `indexer_setup` can be given to share the setup of the metadata indexers
+    between multiple queries for the same book.
+    """
     base_url = prowlarr_config.get_base_url(session)
     api_key = prowlarr_config.get_api_key(session)
     assert base_url is not None and api_key is not None
 
+    categories = prowlarr_config.get_categories(session)
+    cache_key = _get_source_query(session, book_request, indexer_ids)
+    queries = list(cache_key.queries)
+    memory_key = cache_key.model_dump_json()
+    persist = Settings().cache.persist_sources
+
     if not force_refresh:
         source_ttl = prowlarr_config.get_source_ttl(session)
-        cached_sources = prowlarr_source_cache.get(source_ttl, query)
-        if cached_sources:
+        cached_sources = prowlarr_source_cache.get(source_ttl, memory_key)
+        if cached_sources is not None:
             return cached_sources
 
-    params: dict[str, Any] = {
-        "query": query,
-        "type": "search",
-        "limit": 100,
-        "offset": 0,
-    }
+        cached_response = (
+            await prowlarr_response_cache.get(cache_key) if persist else None
+        )
+        if cached_response:
+            sources = await _sources_from_results(
+                session,
+                client_session,
+                book_request,
+                cached_response.value,
+                indexer_setup,
+            )
+            prowlarr_source_cache.set(
+                sources, memory_key, cached_at=cached_response.timestamp
+            )
+            return sources
+
+    params: dict[str, Any] = {"type": "search"}
 
-    if len(x := prowlarr_config.get_categories(session)) > 0:
-        params["categories"] = x
+    if len(categories) > 0:
+        params["categories"] = categories
 
     if indexer_ids is not None:
         params["indexerIds"] = indexer_ids
 
+    # the variants are searched concurrently. The prowlarr upstream limits the requests in flight
+    variant_results = await asyncio.gather(
+        *[
+            _fetch_search_results(
+                session,
+                client_session,
+                [book_request.title],
+                base_url,
+                api_key,
+                params | {"query": query},
+            )
+            for query in queries
+        ]
+    )
+    search_results = _merge_results(variant_results)
+
+    sources = await _sources_from_results(
+        session, client_session, book_request, search_results, indexer_setup
+    )
+
+    prowlarr_source_cache.set(sources, memory_key)
+    if persist:
+        await prowlarr_response_cache.set(cache_key, search_results)
+
+    return sources
+
+
+def _merge_results(
+    variant_results: list[list[dict[str, Any]]],
+) -> list[dict[str, Any]]:
+    """Merges the results of multiple queries, keeping the first result of every guid"""
+    merged: list[dict[str, Any]] = []
+    seen_guids: set[str] = set()
+    for results in variant_results:
+        for result in results:
+            guid = result.get("guid")
+            if guid in seen_guids:
+                continue
+            if guid is not None:
+                seen_guids.add(guid)
+            merged.append(result)
+    return merged
+
+
+async def _fetch_search_page(
+    client_session: ClientSession,
+    base_url: str,
+    api_key: str,
+    params: dict[str, Any],
+    offset: int,
+) -> list[dict[str, Any]]:
+    params = params | {"limit": PAGE_SIZE, "offset": offset}
     url = posixpath.join(base_url, f"api/v1/search?{urlencode(params, doseq=True)}")
 
     logger.info("Querying prowlarr: %s", url)
 
-    async with client_session.get(
+    async with get_upstream("prowlarr").get(
+        client_session,
         url,
         headers={"X-Api-Key": api_key},
     ) as response:
-        search_results = await response.json()
+        return await response.json()
+
 
+async def _fetch_search_results(
+    session: Session,
+    client_session: ClientSession,
+    titles: list[str],
+    base_url: str,
+    api_key: str,
+    params: dict[str, Any],
+) -> list[dict[str, Any]]:
+    """
+    Fetches up to the configured maximum amount of results. Pages after the first one
+    are fetched `PAGE_CONCURRENCY` at a time and fetching stops early once a batch of
+    pages does not contain any new results that match one of the titles.
+    """
+    max_results = max(PAGE_SIZE, prowlarr_config.get_max_results(session))
+    title_exists_ratio = quality_config.get_title_exists_ratio(session)
+
+    short_titles = [short_title(title) for title in titles]
+
+    def is_candidate(result: dict[str, Any]) -> bool:
+        return any(
+            fuzz.partial_ratio(
+                title,
+                result.get("title", ""),
+                processor=utils.default_process,
+            )
+            > title_exists_ratio
+            for title in short_titles
+        )
+
+    search_results: list[dict[str, Any]] = []
+    seen_guids: set[str] = set()
+
+    def add_new(page: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        new_results: list[dict[str, Any]] = []
+        for result in page:
+            guid = result.get("guid")
+            if guid in seen_guids:
+                continue
+            if guid is not None:
+                seen_guids.add(guid)
+            new_results.append(result)
+        search_results.extend(new_results)
+        return new_results
+
+    first_page = await _fetch_search_page(client_session, base_url, api_key, params, 0)
+    add_new(first_page)
+    if len(first_page) < PAGE_SIZE:
+        return search_results
+
+    offsets = list(range(PAGE_SIZE, max_results, PAGE_SIZE))
+    for i in range(0, len(offsets), PAGE_CONCURRENCY):
+        pages = await asyncio.gather(
+            *[
+                _fetch_search_page(client_session, base_url, api_key, params, offset)
+                for offset in offsets[i : i + PAGE_CONCURRENCY]
+            ]
+        )
+        new_results: list[dict[str, Any]] = []
+        for page in pages:
+            new_results.extend(add_new(page))
+        if any(len(page) < PAGE_SIZE for page in pages):
+            break
+        if not any(is_candidate(result) for result in new_results):
+            logger.debug(
+                "No new matching results after %d results, stopping",
+                len(search_results),
+            )
+            break
+
+    return search_results
+
+
+async def _sources_from_results(
+    session: Session,
+    client_session: ClientSession,
+    book_request: BookRequest,
+    search_results: list[dict[str, Any]],
+    indexer_setup: Optional[asyncio.Task[list[IndexerContext]]] = None,
+) -> list[ProwlarrSource]:
+    sources = parse_sources(search_results)
+
+    # add additional metadata using any available indexers
+    container = SessionContainer(session=session, client_session=client_session)
+    if indexer_setup:
+        # shielded, so a timed out query does not cancel the setup for the other queries
+        contexts = await asyncio.shield(indexer_setup)
+        await edit_sources(sources, contexts, container)
+    else:
+        await edit_source_metadata(book_request, sources, container)
+
+    return sources
+
+
+async def query_prowlarr_per_indexer(
+    session: Session,
+    client_session: ClientSession,
+    book_request: BookRequest,
+    force_refresh: bool = False,
+) -> AsyncGenerator[tuple[ProwlarrIndexer, list[ProwlarrSource]], None]:
+    """
+    Searches every enabled indexer with its own request and yields the sources of each
+    indexer as soon as it answers. Indexers that fail or do not answer within the
+    configured timeout are skipped, so a single slow indexer does not hold up the others.
+    """
+    indexers = await get_enabled_indexers(session, client_session)
+    timeout = prowlarr_config.get_indexer_timeout(session)
+    container = SessionContainer(session=session, client_session=client_session)
+    indexer_setup = asyncio.create_task(setup_indexers(book_request, container))
+
+    async def search(indexer: ProwlarrIndexer):
+        try:
+            sources = await asyncio.wait_for(
+                query_prowlarr(
+                    session,
+                    client_session,
+                    book_request,
+                    indexer_ids=[indexer.id],
+                    force_refresh=force_refresh,
+                    indexer_setup=indexer_setup,
+                ),
+                timeout,
+            )
+        except TimeoutError:
+            logger.warning("Indexer %s timed out after %ds", indexer.name, timeout)
+            sources = []
+        except ClientError as e:
+            logger.warning("Failed to search indexer %s: %s", indexer.name, e)
+            sources = []
+        return indexer, sources
+
+    tasks = [asyncio.create_task(search(indexer)) for indexer in indexers]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks + [indexer_setup]:
+            task.cancel()
+
+
+def parse_sources(search_results: list[Any]) -> list[ProwlarrSource]:
+    """Parses sources in the format of the prowlarr search api"""
     sources: list[ProwlarrSource] = []
     for result in search_results:
         try:
@@ -219,10 +652,4 @@ async def query_prowlarr(
         except KeyError as e:
             logger.error("Failed to parse source: %s. KeyError: %s", result, e)
 
-    # add additional metadata using any available indexers
-    container = SessionContainer(session=session, client_session=client_session)
-    await edit_source_metadata(book_request, sources, container)
-
-    prowlarr_source_cache.set(sources, query)
-
     return sources
@@ -0,0 +1,37 @@
+import re
+
+from app.internal.models import BookRequest
+
+# series or edition suffixes like "(The Stormlight Archive, Book 1)" or "[Dramatized Adaptation]"
+_bracket_suffix_re = re.compile(r"\s*[(\[][^()\[\]]*[)\]]\s*$")
+# subtitles appended to the title like "Dune: Book One" or "Mistborn - The Final Empire"
+_subtitle_suffix_re = re.compile(r"\s*(:|\s-\s|\s–\s).*$")
+
+
+def short_title(title: str) -> str:
+    """Removes subtitles and series suffixes from the title"""
+    shortened = title
+    while match := _bracket_suffix_re.search(shortened):
+        shortened = shortened[: match.start()]
+    shortened = _subtitle_suffix_re.sub("", shortened)
+    return shortened.strip() or title
+
+
+def get_query_variants(book_request: BookRequest) -> list[str]:
+    """
+    Returns the queries a book is searched for with. Releases are named
+    inconsistently, so besides the title they are searched for by the title
+    without a subtitle, the title with the first author and the ASIN.
+    """
+    title = " ".join(book_request.title.split())
+    shortened = short_title(title)
+    variants = [title, shortened]
+    if book_request.authors:
+        variants.append(f"{shortened} {book_request.authors[0]}")
+    variants.append(book_request.asin)
+
+    unique_variants: list[str] = []
+    for variant in variants:
+        if variant.lower() not in (v.lower() for v in unique_variants):
+            unique_variants.append(variant)
+    return unique_variants
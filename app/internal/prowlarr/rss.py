@@ -0,0 +1,141 @@
+import logging
+import posixpath
+import xml.etree.ElementTree as ET
+from email.utils import parsedate_to_datetime
+from typing import Any, Optional
+from urllib.parse import urlencode
+
+from aiohttp import ClientSession
+from sqlmodel import Session
+
+from app.internal.models import ProwlarrSource
+from app.internal.prowlarr.prowlarr import (
+    ProwlarrIndexer,
+    parse_sources,
+    prowlarr_config,
+)
+from app.util.cache import StringConfigCache
+from app.util.governor import get_upstream
+
+logger = logging.getLogger(__name__)
+
+# torznab and newznab feeds add their attributes as <torznab:attr name="" value="" />
+_ATTR_NAMESPACES = [
+    "http://torznab.com/schemas/2015/feed",
+    "http://www.newznab.com/DTD/2010/feeds/attributes/",
+]
+
+# guid of the newest release that has been seen in the feed of every indexer. Stored in
+# the config table, as a lost guid would make the whole feed count as new again
+last_seen_config = StringConfigCache[str]()
+
+
+def _get_attrs(item: ET.Element) -> dict[str, str]:
+    attrs: dict[str, str] = {}
+    for namespace in _ATTR_NAMESPACES:
+        for attr in item.findall(f"{{{namespace}}}attr"):
+            name, value = attr.get("name"), attr.get("value")
+            if name and value is not None:
+                attrs[name.lower()] = value
+    return attrs
+
+
+def _to_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def parse_feed(feed: str, indexer: ProwlarrIndexer) -> list[dict[str, Any]]:
+    """Turns the items of a feed into results in the format of the prowlarr search api"""
+    results: list[dict[str, Any]] = []
+    for item in ET.fromstring(feed).iter("item"):
+        attrs = _get_attrs(item)
+        enclosure = item.find("enclosure")
+        pub_date = item.findtext("pubDate")
+        title = item.findtext("title")
+        guid = item.findtext("guid") or item.findtext("link")
+        if not title or not guid or not pub_date:
+            continue
+        try:
+            publish_date = parsedate_to_datetime(pub_date)
+        except (TypeError, ValueError):
+            continue
+        size = _to_int(item.findtext("size")) or _to_int(attrs.get("size"))
+        if size is None and enclosure is not None:
+            size = _to_int(enclosure.get("length"))
+        seeders = _to_int(attrs.get("seeders")) or 0
+        results.append(
+            {
+                "protocol": indexer.protocol,
+                "guid": guid,
+                "indexerId": indexer.id,
+                "indexer": indexer.name,
+                "title": title,
+                "seeders": seeders,
+                "leechers": max(0, (_to_int(attrs.get("peers")) or 0) - seeders),
+                "grabs": _to_int(attrs.get("grabs")),
+                "size": size or 0,
+                "infoUrl": item.findtext("comments"),
+                "downloadUrl": (
+                    enclosure.get("url")
+                    if enclosure is not None
+                    else item.findtext("link")
+                ),
+                "magnetUrl": attrs.get("magneturl"),
+                "publishDate": publish_date.isoformat(),
+            }
+        )
+    return results
+
+
+async def fetch_new_releases(
+    session: Session, client_session: ClientSession, indexer: ProwlarrIndexer
+) -> list[ProwlarrSource]:
+    """
+    Fetches the newznab/torznab feed Prowlarr provides for the indexer and returns the
+    releases that were added since the last call. Feeds list the newest releases first,
+    so only the items before the last seen guid are new. The first call for an indexer
+    only remembers its newest release.
+    """
+    base_url = prowlarr_config.get_base_url(session)
+    api_key = prowlarr_config.get_api_key(session)
+    assert base_url is not None and api_key is not None
+
+    params: dict[str, Any] = {"t": "search", "extended": 1, "apikey": api_key}
+    categories = prowlarr_config.get_categories(session)
+    if len(categories) > 0:
+        params["cat"] = ",".join(str(c) for c in categories)
+    url = posixpath.join(base_url, f"{indexer.id}/api?{urlencode(params)}")
+
+    async with get_upstream("prowlarr").get(client_session, url) as response:
+        response.raise_for_status()
+        feed = await response.text()
+
+    try:
+        results = parse_feed(feed, indexer)
+    except ET.ParseError as e:
+        logger.warning("Failed to parse the feed of %s: %s", indexer.name, e)
+        return []
+    if not results:
+        return []
+
+    config_key = f"prowlarr_rss_last_seen_{indexer.id}"
+    last_seen = last_seen_config.get(session, config_key)
+    if last_seen != results[0]["guid"]:
+        last_seen_config.set(session, config_key, results[0]["guid"])
+    if last_seen is None:
+        # the feed of an indexer that was never polled before only marks where new
+        # releases start, instead of treating all of its releases as new
+        logger.debug("Started following the feed of %s", indexer.name)
+        return []
+
+    new_results: list[dict[str, Any]] = []
+    for result in results:
+        if result["guid"] == last_seen:
+            break
+        new_results.append(result)
+
+    logger.debug("Found %d new releases on %s", len(new_results), indexer.name)
+    return parse_sources(new_results)
@@ -4,7 +4,7 @@ from types import CoroutineType
 from typing import Any
 
 from app.internal.indexers.abstract import SessionContainer
-from app.internal.indexers.indexer_util import get_indexer_contexts
+from app.internal.indexers.indexer_util import IndexerContext, get_indexer_contexts
 from app.internal.models import BookRequest, ProwlarrSource
 
 logger = logging.getLogger(__name__)
@@ -15,6 +15,14 @@ async def edit_source_metadata(
     sources: list[ProwlarrSource],
     container: SessionContainer,
 ):
+    contexts = await setup_indexers(book_request, container)
+    await edit_sources(sources, contexts, container)
+
+
+async def setup_indexers(
+    book_request: BookRequest,
+    container: SessionContainer,
+) -> list[IndexerContext]:
     contexts = await get_indexer_contexts(container)
 
     coros = [
@@ -25,7 +33,15 @@ async def edit_source_metadata(
     for exc in exceptions:
         if exc:
             logger.error("Failed to setup indexer: %s", exc)
+    return contexts
 
+
+async def edit_sources(
+    sources: list[ProwlarrSource],
+    contexts: list[IndexerContext],
+    container: SessionContainer,
+):
+    """Adds metadata to the sources using indexers that were set up with `setup_indexers`"""
     coros: list[CoroutineType[Any, Any, None]] = []
     for source in sources:
         for context in contexts:
@@ -1,20 +1,42 @@
 # what is currently being queried
+import asyncio
+import logging
+import time
+import uuid
 from contextlib import contextmanager
+from typing import Optional
 
 import pydantic
-from aiohttp import ClientSession
+from aiohttp import ClientError, ClientSession
 from fastapi import HTTPException
 from sqlmodel import Session, select
 
+from app.internal.download_queue import enqueue_download, has_pending_download
 from app.internal.models import BookRequest, ProwlarrSource
 from app.internal.prowlarr.prowlarr import (
+    get_enabled_indexers,
     prowlarr_config,
     query_prowlarr,
-    start_download,
+    query_prowlarr_per_indexer,
 )
-from app.internal.ranking.download_ranking import rank_sources
+from app.internal.ranking.download_ranking import (
+    RankSource,
+    get_rank_sources,
+    is_valid_source,
+    rank_sources,
+    sort_rank_sources,
+)
+from app.util.background import run_in_background
+from app.util.connection import get_client_session
+from app.util.db import open_session
+from app.util.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
 
 querying: set[str] = set()
+# concurrent queries for the same book share a single prowlarr search. Forced refreshes
+# only share searches with other forced refreshes, so they never get cached sources
+sources_flight = SingleFlight[tuple[str, bool], list[ProwlarrSource]]()
 
 
 @contextmanager
@@ -29,9 +51,139 @@ def manage_queried(asin: str):
             pass
 
 
+class SourceSearch:
+    """Sources of a search, ranked with the results of all indexers that answered so far"""
+
+    def __init__(self):
+        self.sources: list[ProwlarrSource] = []
+        self.pending_indexers: list[str] = []
+        self.finished_at: Optional[float] = None
+        # set by the run that fills in the sources. Only that run finishes the search
+        self.claimed = False
+        self._finished = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    def finish(self):
+        if self.finished_at is None:
+            self.finished_at = time.time()
+        self._finished.set()
+
+    async def wait(self, timeout: float):
+        try:
+            await asyncio.wait_for(self._finished.wait(), timeout)
+        except TimeoutError:
+            pass
+
+
+# finished searches are kept for a while, so the sources page can show their results
+SOURCE_SEARCH_RETENTION = 10 * 60
+# latest search of each book when searching every indexer separately
+source_searches: dict[str, SourceSearch] = {}
+
+
+def _new_source_search(asin: str) -> SourceSearch:
+    now = time.time()
+    for key, search in list(source_searches.items()):
+        if search.finished_at and search.finished_at + SOURCE_SEARCH_RETENTION < now:
+            del source_searches[key]
+    search = SourceSearch()
+    source_searches[asin] = search
+    return search
+
+
+async def start_source_search(
+    session: Session,
+    client_session: ClientSession,
+    asin: str,
+    requester_username: str,
+    force_refresh: bool = False,
+) -> SourceSearch:
+    """
+    Starts searching every indexer in the background, so partial results can be shown
+    while slower indexers are still searching.
+    """
+    search = source_searches.get(asin)
+    if search and not search.done:
+        return search
+    search = _new_source_search(asin)
+    try:
+        indexers = await get_enabled_indexers(session, client_session)
+        search.pending_indexers = [indexer.name for indexer in indexers]
+    except ClientError as e:
+        logger.warning("Failed to get the enabled indexers: %s", e)
+    run_in_background(
+        _query_sources_in_background(search, asin, requester_username, force_refresh)
+    )
+    return search
+
+
+async def _query_sources_in_background(
+    search: SourceSearch, asin: str, requester_username: str, force_refresh: bool
+):
+    try:
+        with open_session() as session:
+            await query_sources(
+                asin,
+                session=session,
+                client_session=get_client_session(),
+                requester_username=requester_username,
+                force_refresh=force_refresh,
+            )
+    finally:
+        # the search is finished by the run that claimed it, unless none did
+        if not search.claimed:
+            search.finish()
+
+
+async def _rank_per_indexer(
+    session: Session,
+    client_session: ClientSession,
+    book: BookRequest,
+    force_refresh: bool,
+) -> list[ProwlarrSource]:
+    search = source_searches.get(book.asin)
+    if search is None or search.done:
+        search = _new_source_search(book.asin)
+    elif search.claimed:
+        # another search of the book, e.g. a forced refresh, is shown on the sources
+        # page already. This one is not shown, so the two do not overwrite each other
+        search = SourceSearch()
+    search.claimed = True
+
+    ranked: list[RankSource] = []
+    try:
+        indexers = await get_enabled_indexers(session, client_session)
+        search.pending_indexers = [indexer.name for indexer in indexers]
+        async for indexer, sources in query_prowlarr_per_indexer(
+            session, client_session, book, force_refresh
+        ):
+            ranked += await get_rank_sources(session, client_session, sources, book)
+            if indexer.name in search.pending_indexers:
+                search.pending_indexers.remove(indexer.name)
+            search.sources = sort_rank_sources(session, book, ranked)
+    finally:
+        search.finish()
+    return search.sources
+
+
+async def _is_valid(
+    session: Session,
+    client_session: ClientSession,
+    source: ProwlarrSource,
+    book: BookRequest,
+) -> bool:
+    rank_sources = await get_rank_sources(session, client_session, [source], book)
+    return any(is_valid_source(session, rs) for rs in rank_sources)
+
+
 class QueryResult(pydantic.BaseModel):
     sources: list[ProwlarrSource]
     book: BookRequest
+    # the download that was queued when the download was started automatically
+    download_job_id: Optional[uuid.UUID] = None
 
 
 async def query_sources(
@@ -41,7 +193,12 @@ async def query_sources(
     requester_username: str,
     force_refresh: bool = False,
     start_auto_download: bool = False,
+    require_valid_source: bool = False,
 ) -> QueryResult:
+    """
+    With `require_valid_source` the best source is only downloaded automatically if it
+    is within the configured quality ranges.
+    """
     with manage_queried(asin):
         prowlarr_config.raise_if_invalid(session)
 
@@ -53,34 +210,43 @@ async def query_sources(
         if not book:
             raise HTTPException(status_code=500, detail="Book asin error")
 
-        sources = await query_prowlarr(
-            session,
-            client_session,
-            book,
-            force_refresh=force_refresh,
-        )
-        ranked = await rank_sources(session, client_session, sources, book)
+        async def fetch_ranked_sources() -> list[ProwlarrSource]:
+            assert book is not None
+            if prowlarr_config.get_parallel_search(session):
+                return await _rank_per_indexer(
+                    session, client_session, book, force_refresh
+                )
+            sources = await query_prowlarr(
+                session,
+                client_session,
+                book,
+                force_refresh=force_refresh,
+            )
+            return await rank_sources(session, client_session, sources, book)
+
+        ranked = await sources_flight.do((asin, force_refresh), fetch_ranked_sources)
 
         # start download if requested
-        if start_auto_download and not book.downloaded and len(ranked) > 0:
-            resp = await start_download(
-                session=session,
-                client_session=client_session,
+        if (
+            start_auto_download
+            and not book.downloaded
+            and len(ranked) > 0
+            and not has_pending_download(session, asin)
+            and (
+                not require_valid_source
+                or await _is_valid(session, client_session, ranked[0], book)
+            )
+        ):
+            download_job = enqueue_download(
+                session,
                 guid=ranked[0].guid,
                 indexer_id=ranked[0].indexer_id,
-                requester_username=requester_username,
                 book_asin=asin,
+                requester_username=requester_username,
+            )
+            return QueryResult(
+                sources=ranked, book=book, download_job_id=download_job.id
             )
-            if resp.ok:
-                same_books = session.exec(
-                    select(BookRequest).where(BookRequest.asin == asin)
-                ).all()
-                for b in same_books:
-                    b.downloaded = True
-                    session.add(b)
-                session.commit()
-            else:
-                raise HTTPException(status_code=500, detail="Failed to start download")
 
         return QueryResult(
             sources=ranked,
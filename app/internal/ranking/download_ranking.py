@@ -1,14 +1,14 @@
 import asyncio
-from functools import cmp_to_key
-from typing import Callable
+from typing import Callable, NamedTuple
 
 import pydantic
 from aiohttp import ClientSession
-from rapidfuzz import fuzz, utils
+from rapidfuzz import fuzz, process, utils
 from sqlmodel import Session
 
 from app.internal.models import BookRequest, ProwlarrSource
-from app.internal.ranking.quality import quality_config
+from app.internal.prowlarr.query_variants import short_title
+from app.internal.ranking.quality import QualityProfile, quality_config
 from app.internal.ranking.quality_extract import Quality, extract_qualities
 
 
@@ -23,235 +23,250 @@ async def rank_sources(
     sources: list[ProwlarrSource],
     book: BookRequest,
 ) -> list[ProwlarrSource]:
+    rank_sources = await get_rank_sources(session, client_session, sources, book)
+    return sort_rank_sources(session, book, rank_sources)
+
+
+async def get_rank_sources(
+    session: Session,
+    client_session: ClientSession,
+    sources: list[ProwlarrSource],
+    book: BookRequest,
+) -> list[RankSource]:
+    """Extracts the qualities of the sources, which is the slow part of ranking"""
+
     async def get_qualities(source: ProwlarrSource):
         qualities = await extract_qualities(session, client_session, source, book)
         return [RankSource(source=source, quality=q) for q in qualities]
 
     coros = [get_qualities(source) for source in sources]
-    rank_sources = [x for y in await asyncio.gather(*coros) for x in y]
+    return [x for y in await asyncio.gather(*coros) for x in y]
 
-    compare = CompareSource(session, book)
-    rank_sources.sort(key=cmp_to_key(compare))
 
-    return [rs.source for rs in rank_sources]
+def sort_rank_sources(
+    session: Session,
+    book: BookRequest,
+    rank_sources: list[RankSource],
+) -> list[ProwlarrSource]:
+    ranker = SourceRanker(session, book)
+    return [rs.source for rs in ranker.sort(rank_sources)]
+
+
+class RankFeatures(NamedTuple):
+    """
+    Features of a source that are compared in order of their importance.
+    Higher is better, except for the ranks.
+    """
+
+    valid: bool
+    title: bool
+    authors: int
+    narrators: int
+    format_rank: int
+    flag_score: int
+    indexer_rank: int
+    subtitle: bool
+    seeders: int
+    age_score: float
+
+
+class BatchScorer:
+    """
+    Scores strings against the titles of many sources. The titles are preprocessed
+    once and every string is scored against all of them in a single rapidfuzz call,
+    which loops over the titles in C instead of in Python.
+    """
+
+    def __init__(self, choices: list[str]):
+        self.choices = [utils.default_process(choice) for choice in choices]
+
+    def scores(
+        self, query: str, scorer: Callable[..., float], score_cutoff: float
+    ) -> list[float]:
+        """Score of the query for every choice, scores below the cutoff are 0"""
+        row = [0.0] * len(self.choices)
+        for _, score, index in process.extract(
+            utils.default_process(query),
+            self.choices,
+            scorer=scorer,
+            processor=None,
+            limit=None,
+            score_cutoff=score_cutoff,
+        ):
+            row[index] = score
+        return row
+
+    def matches(
+        self, query: str, scorer: Callable[..., float], score_cutoff: float
+    ) -> list[bool]:
+        """If the score of the query is above the cutoff for every choice"""
+        return [
+            score > score_cutoff for score in self.scores(query, scorer, score_cutoff)
+        ]
+
 
+class SourceRanker:
+    """
+    Ranks sources by their features. The features of all sources are extracted at
+    once before sorting, so the fuzzy matching is done in batches and not repeated
+    for every comparison.
+    """
 
-class CompareSource:
     def __init__(self, session: Session, book: BookRequest):
-        self.session = session
         self.book = book
-        self.compare_order = [
-            self._compare_valid,
-            self._compare_title,
-            self._compare_authors,
-            self._compare_narrators,
-            self._compare_format,
-            self._compare_flags,
-            self._compare_indexer,
-            self._compare_subtitle,
-            self._compare_seeders,
-            self._compare_age,
-        ]
+        self.profile = quality_config.get_profile(session)
+        self.title_exists_ratio = self.profile.title_exists_ratio
+        self.name_exists_ratio = self.profile.name_exists_ratio
+
+    def features(self, rank_sources: list[RankSource]) -> list[RankFeatures]:
+        titles = BatchScorer([rs.source.title for rs in rank_sources])
+        title_matches = titles.matches(
+            self.book.title, fuzz.partial_ratio, self.title_exists_ratio
+        )
+        if self.book.subtitle:
+            subtitle_matches = titles.matches(
+                self.book.subtitle, fuzz.partial_ratio, self.title_exists_ratio
+            )
+        else:
+            subtitle_matches = [False] * len(rank_sources)
+        authors = self._people_scores(
+            titles,
+            self.book.authors,
+            [rs.source.book_metadata.authors for rs in rank_sources],
+        )
+        narrators = self._people_scores(
+            titles,
+            self.book.narrators,
+            [rs.source.book_metadata.narrators for rs in rank_sources],
+        )
 
-    def __call__(self, a: RankSource, b: RankSource):
-        return self.compare(a, b)
-
-    def compare(self, a: RankSource, b: RankSource) -> int:
-        return self._get_next_compare(0)(a, b, 1)
-
-    def _get_next_compare(
-        self, index: int
-    ) -> Callable[[RankSource, RankSource, int], int]:
-        def default_compare(a: RankSource, b: RankSource, next_compare: int) -> int:
-            return 0
-
-        if index < len(self.compare_order):
-            return self.compare_order[index]
-        return default_compare
-
-    def _is_valid_quality(self, a: RankSource) -> bool:
-        match a.quality.file_format:
-            case "flac":
-                quality_range = quality_config.get_range(self.session, "quality_flac")
-            case "m4b":
-                quality_range = quality_config.get_range(self.session, "quality_m4b")
-            case "mp3":
-                quality_range = quality_config.get_range(self.session, "quality_mp3")
-            case "unknown-audio":
-                quality_range = quality_config.get_range(
-                    self.session, "quality_unknown_audio"
+        features: list[RankFeatures] = []
+        for i, rs in enumerate(rank_sources):
+            source = rs.source
+            if source.protocol == "torrent":
+                seeders = source.seeders
+                # with torrents: newer => better
+                age_score = source.publish_date.timestamp()
+            else:
+                seeders = 0
+                # with usenets: older => better
+                age_score = -source.publish_date.timestamp()
+
+            features.append(
+                RankFeatures(
+                    valid=_is_valid_source(self.profile, rs),
+                    title=title_matches[i],
+                    authors=authors[i],
+                    narrators=narrators[i],
+                    format_rank=self.profile.format_rank(rs.quality.file_format),
+                    flag_score=self.profile.flag_score(source.indexer_flags),
+                    indexer_rank=self.profile.indexer_rank(source.indexer_id),
+                    subtitle=subtitle_matches[i],
+                    seeders=seeders,
+                    age_score=age_score,
                 )
-            case "unknown":
-                quality_range = quality_config.get_range(
-                    self.session, "quality_unknown"
+            )
+        return features
+
+    def _people_scores(
+        self,
+        titles: BatchScorer,
+        book_people: list[str],
+        source_people: list[list[str]],
+    ) -> list[int]:
+        """
+        Batched version of the maximum of `vaguely_exist_in_title` and
+        `fuzzy_author_narrator_match` for every source.
+        """
+        in_title = [0] * len(source_people)
+        for person in book_people:
+            for i, match in enumerate(
+                titles.matches(person, fuzz.token_set_ratio, self.name_exists_ratio)
+            ):
+                in_title[i] += match
+
+        # the names in the metadata of all sources are scored at once as well
+        names = list({name for people in source_people for name in people})
+        name_scorer = BatchScorer(names)
+        matched_names = [
+            {
+                name
+                for name, match in zip(
+                    names,
+                    name_scorer.matches(
+                        person, fuzz.token_set_ratio, self.name_exists_ratio
+                    ),
                 )
+                if match
+            }
+            for person in book_people
+        ]
+        in_metadata = [
+            sum(1 for matched in matched_names if not matched.isdisjoint(people))
+            for people in source_people
+        ]
+        return [max(a, b) for a, b in zip(in_title, in_metadata)]
+
+    def sort_key(self, f: RankFeatures) -> tuple[int | float, ...]:
+        return (
+            -f.valid,
+            -f.title,
+            -f.authors,
+            -f.narrators,
+            f.format_rank,
+            -f.flag_score,
+            f.indexer_rank,
+            -f.subtitle,
+            -f.seeders,
+            -f.age_score,
+        )
 
-        return quality_range.from_kbits < a.quality.kbits < quality_range.to_kbits
+    def sort(self, rank_sources: list[RankSource]) -> list[RankSource]:
+        """Sorts the best sources first"""
+        keys = [self.sort_key(f) for f in self.features(rank_sources)]
+        order = sorted(range(len(rank_sources)), key=keys.__getitem__)
+        return [rank_sources[i] for i in order]
 
-    def _compare_valid(self, a: RankSource, b: RankSource, next_compare: int) -> int:
-        """Filter out any reasons that make it not valid"""
-        if a.source.protocol == "torrent":
-            a_valid = self._is_valid_quality(
-                a
-            ) and a.source.seeders >= quality_config.get_min_seeders(self.session)
-        else:
-            a_valid = self._is_valid_quality(a)
 
-        if b.source.protocol == "torrent":
-            b_valid = self._is_valid_quality(
-                b
-            ) and b.source.seeders >= quality_config.get_min_seeders(self.session)
-        else:
-            b_valid = self._is_valid_quality(b)
+def is_valid_quality(session: Session, a: RankSource) -> bool:
+    return quality_config.get_profile(session).is_valid_quality(
+        a.quality.file_format, a.quality.kbits
+    )
 
-        if a_valid == b_valid:
-            return self._get_next_compare(next_compare)(a, b, next_compare + 1)
-        return int(b_valid) - int(a_valid)
 
-    def _compare_format(self, a: RankSource, b: RankSource, next_compare: int) -> int:
-        if a.quality.file_format == b.quality.file_format:
-            return self._get_next_compare(next_compare)(a, b, next_compare + 1)
-        a_index = quality_config.calculate_quality_rank(
-            self.session, a.quality.file_format
-        )
-        b_index = quality_config.calculate_quality_rank(
-            self.session, b.quality.file_format
-        )
-        return a_index - b_index
+def is_valid_source(session: Session, a: RankSource) -> bool:
+    """If the source is within the configured quality ranges and has enough seeders"""
+    return _is_valid_source(quality_config.get_profile(session), a)
 
-    def _compare_flags(self, a: RankSource, b: RankSource, next_compare: int) -> int:
-        a_score = sum(
-            f.score
-            for f in quality_config.get_indexer_flags(self.session)
-            if f.flag.lower() in a.source.indexer_flags
-        )
-        b_score = sum(
-            f.score
-            for f in quality_config.get_indexer_flags(self.session)
-            if f.flag.lower() in b.source.indexer_flags
-        )
-        if a_score == b_score:
-            return self._get_next_compare(next_compare)(a, b, next_compare + 1)
-        return b_score - a_score
 
-    def _compare_indexer(self, a: RankSource, b: RankSource, next_compare: int) -> int:
-        a_index = quality_config.calculate_indexer_rank(
-            self.session, a.source.indexer_id
-        )
-        b_index = quality_config.calculate_indexer_rank(
-            self.session, b.source.indexer_id
-        )
-        if a_index == b_index:
-            return self._get_next_compare(next_compare)(a, b, next_compare + 1)
-        return a_index - b_index
-
-    def _compare_title(self, a: RankSource, b: RankSource, next_compare: int) -> int:
-        a_title = exists_in_title(
-            self.book.title,
-            a.source.title,
-            quality_config.get_title_exists_ratio(self.session),
-        )
-        b_title = exists_in_title(
-            self.book.title,
-            b.source.title,
-            quality_config.get_title_exists_ratio(self.session),
-        )
-        if a_title == b_title:
-            return self._get_next_compare(next_compare)(a, b, next_compare + 1)
-        return int(b_title) - int(a_title)
-
-    def _compare_subtitle(self, a: RankSource, b: RankSource, next_compare: int) -> int:
-        if not self.book.subtitle:
-            return self._get_next_compare(next_compare)(a, b, next_compare + 1)
-        a_title = exists_in_title(
-            self.book.subtitle,
-            a.source.title,
-            quality_config.get_title_exists_ratio(self.session),
-        )
-        b_title = exists_in_title(
-            self.book.subtitle,
-            b.source.title,
-            quality_config.get_title_exists_ratio(self.session),
-        )
-        if a_title == b_title:
-            return self._get_next_compare(next_compare)(a, b, next_compare + 1)
-        return int(b_title) - int(a_title)
-
-    def _compare_authors(self, a: RankSource, b: RankSource, next_compare: int) -> int:
-        a_score = max(
-            vaguely_exist_in_title(
-                self.book.authors,
-                a.source.title,
-                quality_config.get_name_exists_ratio(self.session),
-            ),
-            fuzzy_author_narrator_match(
-                a.source.book_metadata.authors,
-                self.book.authors,
-                quality_config.get_name_exists_ratio(self.session),
-            ),
-        )
-        b_score = max(
-            vaguely_exist_in_title(
-                self.book.authors,
-                b.source.title,
-                quality_config.get_name_exists_ratio(self.session),
-            ),
-            fuzzy_author_narrator_match(
-                b.source.book_metadata.authors,
-                self.book.authors,
-                quality_config.get_name_exists_ratio(self.session),
-            ),
-        )
-        if a_score == b_score:
-            return self._get_next_compare(next_compare)(a, b, next_compare + 1)
-        return b_score - a_score
-
-    def _compare_narrators(
-        self, a: RankSource, b: RankSource, next_compare: int
-    ) -> int:
-        a_score = max(
-            vaguely_exist_in_title(
-                self.book.narrators,
-                a.source.title,
-                quality_config.get_name_exists_ratio(self.session),
-            ),
-            fuzzy_author_narrator_match(
-                a.source.book_metadata.narrators,
-                self.book.narrators,
-                quality_config.get_name_exists_ratio(self.session),
-            ),
-        )
-        b_score = max(
-            vaguely_exist_in_title(
-                self.book.narrators,
-                b.source.title,
-                quality_config.get_name_exists_ratio(self.session),
-            ),
+def _is_valid_source(profile: QualityProfile, a: RankSource) -> bool:
+    if not profile.is_valid_quality(a.quality.file_format, a.quality.kbits):
+        return False
+    return a.source.protocol != "torrent" or a.source.seeders >= profile.min_seeders
+
+
+def matches_book(session: Session, source: ProwlarrSource, book: BookRequest) -> bool:
+    """
+    If the source is likely to be a release of the book. Used to assign the results of
+    searches that cover multiple books, like the books of an author.
+    """
+    profile = quality_config.get_profile(session)
+    if not exists_in_title(
+        short_title(book.title), source.title, profile.title_exists_ratio
+    ):
+        return False
+    if not book.authors:
+        return True
+    name_exists_ratio = profile.name_exists_ratio
+    return (
+        max(
+            vaguely_exist_in_title(book.authors, source.title, name_exists_ratio),
             fuzzy_author_narrator_match(
-                b.source.book_metadata.narrators,
-                self.book.narrators,
-                quality_config.get_name_exists_ratio(self.session),
+                source.book_metadata.authors, book.authors, name_exists_ratio
             ),
         )
-        if a_score == b_score:
-            return self._get_next_compare(next_compare)(a, b, next_compare + 1)
-        return b_score - a_score
-
-    def _compare_seeders(self, a: RankSource, b: RankSource, next_compare: int) -> int:
-        if a.source.protocol == "usenet" or b.source.protocol == "usenet":
-            return self._get_next_compare(next_compare)(a, b, next_compare + 1)
-        if a.source.seeders == b.source.seeders:
-            return self._get_next_compare(next_compare)(a, b, next_compare + 1)
-        return b.source.seeders - a.source.seeders
-
-    def _compare_age(self, a: RankSource, b: RankSource, next_compare: int) -> int:
-        if a.source.protocol != b.source.protocol:
-            return self._get_next_compare(next_compare)(a, b, next_compare + 1)
-        if a.source.protocol == "usenet":
-            # With usenets: newer => better
-            return int((a.source.publish_date - b.source.publish_date).total_seconds())
-        # With torrents: older => better
-        return int((b.source.publish_date - a.source.publish_date).total_seconds())
+        > 0
+    )
 
 
 def fuzzy_author_narrator_match(
@@ -1,5 +1,5 @@
 import json
-from typing import Literal
+from typing import Literal, Optional
 
 import pydantic
 from pydantic_core import from_json, to_json
@@ -53,12 +53,93 @@ class IndexerFlag(pydantic.BaseModel):
     score: int
 
 
-class QualityProfile(StringConfigCache[QualityConfigKey]):
+_format_keys: dict[FileFormat, QualityFormatKey] = {
+    "flac": "quality_flac",
+    "m4b": "quality_m4b",
+    "mp3": "quality_mp3",
+    "unknown-audio": "quality_unknown_audio",
+    "unknown": "quality_unknown",
+}
+
+
+class QualityProfile(pydantic.BaseModel, frozen=True):
+    """
+    Snapshot of the quality settings used for ranking. The orders are turned into
+    rank lookups, so ranking a source does not need the database or any parsing.
+    """
+
+    version: int
+    ranges: dict[FileFormat, QualityRange]
+    format_ranks: dict[FileFormat, int]
+    indexer_ranks: dict[int, int]
+    indexer_flags: tuple[IndexerFlag, ...]
+    name_exists_ratio: int
+    title_exists_ratio: int
+    min_seeders: int
+
+    def format_rank(self, file_format: FileFormat) -> int:
+        return self.format_ranks.get(file_format, len(self.format_ranks))
+
+    def indexer_rank(self, indexer_id: int) -> int:
+        return self.indexer_ranks.get(indexer_id, len(self.indexer_ranks))
+
+    def flag_score(self, source_flags: list[str]) -> int:
+        return sum(f.score for f in self.indexer_flags if f.flag in source_flags)
+
+    def is_valid_quality(self, file_format: FileFormat, kbits: float) -> bool:
+        quality_range = self.ranges[file_format]
+        return quality_range.from_kbits < kbits < quality_range.to_kbits
+
+
+class QualityConfig(StringConfigCache[QualityConfigKey]):
     _default_quality_range = QualityRange(from_kbits=20.0, to_kbits=400.0)
     _default_name_exists_ratio: int = 75
     _default_title_exists_ratio: int = 90
     _default_min_seeders = 2
 
+    # incremented on every change, so outdated profiles are rebuilt
+    _version = 0
+    _profile: Optional[QualityProfile] = None
+
+    def set(self, session: Session, key: QualityConfigKey, value: str):
+        super().set(session, key, value)
+        self._version += 1
+
+    def delete(self, session: Session, key: QualityConfigKey):
+        super().delete(session, key)
+        self._version += 1
+
+    def get_profile(self, session: Session) -> QualityProfile:
+        """The current quality settings. Only rebuilt after the settings changed."""
+        if self._profile is not None and self._profile.version == self._version:
+            return self._profile
+        format_order = self.get_format_order(session)
+        indexer_order = self.get_indexer_order(session)
+        self._profile = QualityProfile(
+            version=self._version,
+            ranges={
+                file_format: self.get_range(session, key)
+                for file_format, key in _format_keys.items()
+            },
+            format_ranks={
+                # the first occurrence decides the rank, like with list.index
+                file_format: rank
+                for rank, file_format in reversed(list(enumerate(format_order)))
+            },
+            indexer_ranks={
+                indexer_id: rank
+                for rank, indexer_id in reversed(list(enumerate(indexer_order)))
+            },
+            indexer_flags=tuple(
+                IndexerFlag(flag=f.flag.lower(), score=f.score)
+                for f in self.get_indexer_flags(session)
+            ),
+            name_exists_ratio=self.get_name_exists_ratio(session),
+            title_exists_ratio=self.get_title_exists_ratio(session),
+            min_seeders=self.get_min_seeders(session),
+        )
+        return self._profile
+
     def reset_all(self, session: Session):
         # TODO: find a way so values don't have to be repeated here
         keys: list[QualityConfigKey] = [
@@ -159,4 +240,4 @@ class QualityProfile(StringConfigCache[QualityConfigKey]):
             return len(indexer_order)
 
 
-quality_config = QualityProfile()
+quality_config = QualityConfig()
@@ -12,6 +12,7 @@ from sqlmodel import Session
 from app.internal.models import BookRequest, ProwlarrSource
 from app.internal.prowlarr.prowlarr import prowlarr_config
 from app.internal.ranking.quality import FileFormat
+from app.util.governor import get_upstream
 
 # HACK: Disabled because it doesn't work well with ratelimiting
 # We instead completely rely on the title and size of the complete torrent
@@ -89,7 +90,8 @@ async def extract_qualities(
     if source.download_url and ENABLE_TORRENT_INSPECTION:
         try:
             for _ in range(3):
-                async with client_session.get(
+                async with get_upstream("prowlarr").get(
+                    client_session,
                     source.download_url,
                     headers={"X-Api-Key": api_key},
                 ) as response:
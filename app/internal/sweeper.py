@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_
+from sqlmodel import Session, col, func, select
+
+from app.internal.backlog import get_backlog, search_backlog
+from app.internal.env_settings import Settings
+from app.internal.models import BookRequest, MissingBookSearch
+from app.internal.prowlarr.prowlarr import prowlarr_config
+from app.internal.ranking.quality import quality_config
+from app.util.connection import get_client_session
+from app.util.db import open_session
+
+logger = logging.getLogger(__name__)
+
+
+def get_due_asins(session: Session, limit: int) -> list[str]:
+    """
+    Requested books that have not been downloaded and are due to be searched again.
+    Books requested by more users are searched first. Newly requested books were just
+    searched for when they were requested, so they are only due after the first backoff.
+    """
+    now = datetime.now()
+    first_search_after = now - timedelta(seconds=Settings().sweeper.min_backoff)
+    next_search_at = func.max(MissingBookSearch.next_search_at)
+    query = (
+        select(BookRequest.asin)
+        .outerjoin(
+            MissingBookSearch, col(MissingBookSearch.asin) == col(BookRequest.asin)
+        )
+        .where(
+            col(BookRequest.user_username).is_not(None),
+            col(BookRequest.downloaded).is_(False),
+        )
+        .group_by(col(BookRequest.asin))
+        .having(
+            or_(
+                and_(
+                    next_search_at.is_(None),
+                    func.max(BookRequest.updated_at) <= first_search_after,
+                ),
+                next_search_at <= now,
+            )
+        )
+        .order_by(
+            func.count(func.distinct(BookRequest.user_username)).desc(),
+            func.coalesce(func.max(MissingBookSearch.attempts), 0),
+            func.min(BookRequest.updated_at),
+        )
+        .limit(limit)
+    )
+    return list(session.exec(query).all())
+
+
+def _get_backoff(attempts: int) -> timedelta:
+    settings = Settings().sweeper
+    # capped exponent, so the backoff can not overflow
+    backoff = settings.min_backoff * 2 ** min(attempts - 1, 32)
+    return timedelta(seconds=min(backoff, settings.max_backoff))
+
+
+def _schedule_next_searches(session: Session, asins: list[str]):
+    missing = set(
+        session.exec(
+            select(BookRequest.asin).where(
+                col(BookRequest.asin).in_(asins),
+                col(BookRequest.user_username).is_not(None),
+                col(BookRequest.downloaded).is_(False),
+            )
+        ).all()
+    )
+    now = datetime.now()
+    for asin in asins:
+        search = session.get(MissingBookSearch, asin)
+        if asin not in missing:
+            if search:
+                session.delete(search)
+            continue
+        if search is None:
+            search = MissingBookSearch(asin=asin, searched_at=now, next_search_at=now)
+        search.attempts += 1
+        search.searched_at = now
+        search.next_search_at = now + _get_backoff(search.attempts)
+        session.add(search)
+
+    # books that were downloaded or removed from the wishlist in the meantime
+    stale = session.exec(
+        select(MissingBookSearch).where(
+            col(MissingBookSearch.asin).not_in(
+                select(BookRequest.asin).where(
+                    col(BookRequest.user_username).is_not(None),
+                    col(BookRequest.downloaded).is_(False),
+                )
+            )
+        )
+    ).all()
+    for search in stale:
+        session.delete(search)
+    session.commit()
+
+
+async def sweep_missing_books(batch_size: int):
+    """
+    Searches sources for the requested books that are due and downloads them if
+    auto download is enabled and a valid source is found.
+    """
+    with open_session() as session:
+        if not prowlarr_config.is_valid(session):
+            return
+        asins = get_due_asins(session, batch_size)
+        if not asins:
+            return
+
+        # books that are being searched for already are skipped and stay due
+        books = get_backlog(session, asins)
+        if not books:
+            return
+
+        logger.info("Searching sources for %d missing books", len(books))
+        try:
+            await search_backlog(
+                session,
+                get_client_session(),
+                start_auto_download=quality_config.get_auto_download(session),
+                books=books,
+            )
+        finally:
+            _schedule_next_searches(session, [book.asin for book in books])
+
+
+async def sweep_missing_books_periodically():
+    interval = Settings().sweeper.interval
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await sweep_missing_books(Settings().sweeper.batch_size)
+        except Exception as e:
+            logger.error("Searching missing books failed: %s", e)
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Sequence
+
+from aiohttp import ClientError
+from fastapi import HTTPException
+from rapidfuzz import utils
+from sqlmodel import Session
+
+from app.internal.backlog import get_backlog, get_trusted_usernames
+from app.internal.env_settings import Settings
+from app.internal.models import BookRequest, ProwlarrSource
+from app.internal.indexers.abstract import SessionContainer
+from app.internal.prowlarr.prowlarr import (
+    ProwlarrIndexer,
+    cache_sources,
+    get_cached_sources,
+    get_enabled_indexers,
+    prowlarr_config,
+)
+from app.internal.prowlarr.query_variants import short_title
+from app.internal.prowlarr.rss import fetch_new_releases
+from app.internal.prowlarr.source_metadata import edit_source_metadata
+from app.internal.query import query_sources
+from app.internal.ranking.download_ranking import matches_book
+from app.internal.ranking.quality import quality_config
+from app.util.connection import get_client_session
+from app.util.db import open_session
+
+logger = logging.getLogger(__name__)
+
+# words that appear in too many titles to tell books apart
+_STOPWORDS = {"a", "an", "and", "by", "for", "in", "of", "on", "the", "to"}
+
+
+def _tokenize(text: str) -> set[str]:
+    return {
+        token
+        for token in utils.default_process(text).split()
+        if len(token) > 1 and token not in _STOPWORDS
+    }
+
+
+class WishlistIndex:
+    """
+    Inverted index from the words of the titles of wishlisted books to the books.
+    A release title only has to be compared with the books that share enough words
+    with it, instead of with the whole wishlist. The authors are verified afterwards.
+    """
+
+    def __init__(self, books: Sequence[BookRequest]):
+        self.books: dict[str, BookRequest] = {}
+        self._title_tokens: dict[str, set[str]] = {}
+        self._index: dict[str, set[str]] = defaultdict(set)
+        for book in books:
+            self.books[book.asin] = book
+            title_tokens = _tokenize(short_title(book.title))
+            self._title_tokens[book.asin] = title_tokens
+            for token in title_tokens:
+                self._index[token].add(book.asin)
+
+    def __len__(self):
+        return len(self.books)
+
+    def candidates(self, release_title: str) -> list[BookRequest]:
+        """Books that share at least half of their title words with the release"""
+        hits: dict[str, int] = defaultdict(int)
+        for token in _tokenize(release_title):
+            for asin in self._index.get(token, ()):
+                hits[asin] += 1
+        return [
+            self.books[asin]
+            for asin, count in hits.items()
+            if count * 2 >= len(self._title_tokens[asin])
+        ]
+
+    def match(self, session: Session, source: ProwlarrSource) -> list[BookRequest]:
+        """Books the release belongs to, verified with the fuzzy matchers of the ranking"""
+        return [
+            book
+            for book in self.candidates(source.title)
+            if matches_book(session, source, book)
+        ]
+
+
+async def poll_rss_feeds():
+    """
+    Matches the releases that were added to the feeds of all indexers since the last poll
+    against the wishlist. The new releases are added to the cached sources of the books,
+    books without cached sources are searched for again. They are downloaded if auto
+    download is enabled and the best source is valid.
+    """
+    with open_session() as session:
+        if not prowlarr_config.is_valid(session):
+            return
+        index = WishlistIndex(get_backlog(session))
+        if len(index) == 0:
+            return
+
+        client_session = get_client_session()
+        indexers = await get_enabled_indexers(session, client_session)
+
+        async def fetch(indexer: ProwlarrIndexer) -> list[ProwlarrSource]:
+            try:
+                return await fetch_new_releases(session, client_session, indexer)
+            except ClientError as e:
+                logger.warning("Failed to fetch the feed of %s: %s", indexer.name, e)
+                return []
+
+        releases = await asyncio.gather(*[fetch(indexer) for indexer in indexers])
+
+        matched: dict[str, list[ProwlarrSource]] = defaultdict(list)
+        for source in (source for sources in releases for source in sources):
+            for book in index.match(session, source):
+                logger.info("New release %s matches %s", source.title, book.title)
+                # copied, as the additional metadata depends on the book
+                matched[book.asin].append(source.model_copy(deep=True))
+        if not matched:
+            return
+
+        auto_download = quality_config.get_auto_download(session)
+        trusted = get_trusted_usernames(session)
+        container = SessionContainer(session=session, client_session=client_session)
+        for asin, new_sources in matched.items():
+            book = index.books[asin]
+            # the new releases are added to the cached sources of the book. Only books
+            # without cached sources have to be searched again
+            cached_sources = await get_cached_sources(session, client_session, book)
+            if cached_sources is not None:
+                await edit_source_metadata(book, new_sources, container)
+                known = {source.guid for source in cached_sources}
+                await cache_sources(
+                    session,
+                    client_session,
+                    book,
+                    cached_sources
+                    + [source for source in new_sources if source.guid not in known],
+                )
+            try:
+                await query_sources(
+                    book.asin,
+                    session=session,
+                    client_session=client_session,
+                    requester_username=book.user_username or "",
+                    force_refresh=cached_sources is None,
+                    start_auto_download=auto_download and book.user_username in trusted,
+                    require_valid_source=True,
+                )
+            except (HTTPException, ClientError) as e:
+                logger.warning("Failed to search sources for %s: %s", book.asin, e)
+
+
+async def poll_rss_feeds_periodically():
+    interval = Settings().rss.interval
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await poll_rss_feeds()
+        except Exception as e:
+            logger.error("Polling the indexer feeds failed: %s", e)
@@ -1,4 +1,6 @@
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Any
 from urllib.parse import quote_plus, urlencode
@@ -16,10 +18,16 @@ from app.internal.auth.session_middleware import (
     DynamicSessionMiddleware,
     middleware_linker,
 )
+from app.internal.book_search import metadata_writer, refresh_books_periodically
+from app.internal.download_queue import run_download_workers
 from app.internal.env_settings import Settings
 from app.internal.models import User
-from app.routers import auth, root, search, settings, wishlist
+from app.internal.sweeper import sweep_missing_books_periodically
+from app.internal.wishlist_index import poll_rss_feeds_periodically
+from app.routers import auth, covers, root, search, settings, wishlist
+from app.util.connection import close_client_session
 from app.util.db import open_session
+from app.util.persistent_cache import expire_persistent_caches
 from app.util.templates import templates
 from app.util.toast import ToastException
 
@@ -36,8 +44,27 @@ logging.basicConfig(
 with open_session() as session:
     auth_secret = auth_config.get_auth_secret(session)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    expire_task = asyncio.create_task(expire_persistent_caches())
+    refresh_task = asyncio.create_task(refresh_books_periodically())
+    sweeper_task = asyncio.create_task(sweep_missing_books_periodically())
+    rss_task = asyncio.create_task(poll_rss_feeds_periodically())
+    download_task = asyncio.create_task(run_download_workers())
+    yield
+    expire_task.cancel()
+    refresh_task.cancel()
+    sweeper_task.cancel()
+    rss_task.cancel()
+    download_task.cancel()
+    metadata_writer.flush()
+    await close_client_session()
+
+
 app = FastAPI(
     title="AudioBookRequest",
+    lifespan=lifespan,
     debug=Settings().app.debug,
     openapi_url="/openapi.json" if Settings().app.openapi_enabled else None,
     middleware=[
@@ -47,6 +74,7 @@ app = FastAPI(
 )
 
 app.include_router(auth.router)
+app.include_router(covers.router)
 app.include_router(root.router)
 app.include_router(search.router)
 app.include_router(settings.router)
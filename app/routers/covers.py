@@ -0,0 +1,41 @@
+from typing import Annotated
+
+from aiohttp import ClientSession
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import FileResponse, RedirectResponse
+from sqlmodel import Session
+
+from app.internal.auth.authentication import DetailedUser, get_authenticated_user
+from app.internal.covers import cover_content_type, get_cover, get_cover_image_url
+from app.util.connection import get_connection
+from app.util.db import get_session
+
+router = APIRouter(prefix="/covers")
+
+# covers rarely change. Browsers revalidate them with the etag after a month
+CACHE_CONTROL = "private, max-age=2592000"
+
+
+@router.get("/{asin}")
+async def read_cover(
+    request: Request,
+    asin: str,
+    user: Annotated[DetailedUser, Depends(get_authenticated_user())],
+    session: Annotated[Session, Depends(get_session)],
+    client_session: Annotated[ClientSession, Depends(get_connection)],
+):
+    url = get_cover_image_url(session, asin)
+    if not url:
+        raise HTTPException(status_code=404, detail="Cover not found")
+
+    path = await get_cover(client_session, asin, url)
+    if path is None:
+        # let the browser try to fetch the original cover itself
+        return RedirectResponse(url)
+
+    stat = path.stat()
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = {"Cache-Control": CACHE_CONTROL, "ETag": etag}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=cover_content_type(path), headers=headers)
@@ -1,7 +1,8 @@
+import logging
 from typing import Annotated, Optional
 
 import sqlalchemy as sa
-from aiohttp import ClientSession
+from aiohttp import ClientError, ClientSession
 from fastapi import (
     APIRouter,
     BackgroundTasks,
@@ -18,7 +19,10 @@ from app.internal.book_search import (
     audible_region_type,
     audible_regions,
     get_book_by_asin,
+    get_existing_books,
     list_audible_books,
+    prefetch_search_pages,
+    search_local_books,
 )
 from app.internal.models import (
     BookRequest,
@@ -37,31 +41,34 @@ from app.internal.query import query_sources
 from app.internal.ranking.quality import quality_config
 from app.routers.wishlist import get_wishlist_books
 from app.internal.auth.authentication import DetailedUser, get_authenticated_user
-from app.util.connection import get_connection
+from app.util.connection import get_client_session, get_connection
 from app.util.db import get_session, open_session
 from app.util.templates import template_response
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/search")
 
 
 def get_already_requested(session: Session, results: list[BookRequest], username: str):
     books: list[BookSearchResult] = []
     if len(results) > 0:
-        # check what books are already requested by the user
+        # check what books are already requested by the user or downloaded
         asins = {book.asin for book in results}
-        requested_books = set(
-            session.exec(
-                select(BookRequest.asin).where(
-                    col(BookRequest.asin).in_(asins),
-                    BookRequest.user_username == username,
-                )
-            ).all()
-        )
+        requests = session.exec(
+            select(
+                BookRequest.asin, BookRequest.user_username, BookRequest.downloaded
+            ).where(col(BookRequest.asin).in_(asins))
+        ).all()
+        requested_books = {asin for asin, user, _ in requests if user == username}
+        downloaded_books = {asin for asin, _, downloaded in requests if downloaded}
 
         for book in results:
             book_search = BookSearchResult.model_validate(book)
             if book.asin in requested_books:
                 book_search.already_requested = True
+            if book.asin in downloaded_books:
+                book_search.downloaded = True
             books.append(book_search)
     return books
 
@@ -76,18 +83,28 @@ async def read_search(
     num_results: int = 20,
     page: int = 0,
     region: audible_region_type = "us",
+    local: bool = False,
 ):
     if audible_regions.get(region) is None:
         raise HTTPException(status_code=400, detail="Invalid region")
-    if query:
-        results = await list_audible_books(
-            session=session,
-            client_session=client_session,
-            query=query,
-            num_results=num_results,
-            page=page,
-            audible_region=region,
-        )
+    if query and not local:
+        try:
+            results = await list_audible_books(
+                session=session,
+                client_session=client_session,
+                query=query,
+                num_results=num_results,
+                page=page,
+                audible_region=region,
+            )
+            if len(results) == num_results:
+                prefetch_search_pages(query, num_results, page, region)
+        except ClientError as e:
+            logger.warning("Audible search failed, using local search instead: %s", e)
+            local = True
+            results = search_local_books(session, query, num_results, page)
+    elif query:
+        results = search_local_books(session, query, num_results, page)
     else:
         results = []
 
@@ -110,6 +127,7 @@ async def read_search(
             "auto_start_download": quality_config.get_auto_download(session)
             and user.is_above(GroupEnum.trusted),
             "prowlarr_configured": prowlarr_configured,
+            "local_results": local,
         },
     )
 
@@ -118,32 +136,31 @@ async def read_search(
 async def search_suggestions(
     request: Request,
     user: Annotated[DetailedUser, Depends(get_authenticated_user())],
+    client_session: Annotated[ClientSession, Depends(get_connection)],
     query: Annotated[str, Query(alias="q")],
     region: audible_region_type = "us",
 ):
-    async with ClientSession() as client_session:
-        suggestions = await book_search.get_search_suggestions(
-            client_session, query, region
-        )
-        return template_response(
-            "search.html",
-            request,
-            user,
-            {"suggestions": suggestions},
-            block_name="search_suggestions",
-        )
+    suggestions = await book_search.get_search_suggestions(
+        client_session, query, region
+    )
+    return template_response(
+        "search.html",
+        request,
+        user,
+        {"suggestions": suggestions},
+        block_name="search_suggestions",
+    )
 
 
 async def background_start_query(asin: str, requester_username: str):
     with open_session() as session:
-        async with ClientSession() as client_session:
-            await query_sources(
-                asin=asin,
-                session=session,
-                client_session=client_session,
-                start_auto_download=True,
-                requester_username=requester_username,
-            )
+        await query_sources(
+            asin=asin,
+            session=session,
+            client_session=get_client_session(),
+            start_auto_download=True,
+            requester_username=requester_username,
+        )
 
 
 @router.post("/request/{asin}")
@@ -159,7 +176,9 @@ async def add_request(
     region: Annotated[audible_region_type, Form()],
     num_results: Annotated[int, Form()] = 20,
 ):
-    book = await get_book_by_asin(client_session, asin, region)
+    book = get_existing_books(session, {asin}, region).get(asin)
+    if not book:
+        book = await get_book_by_asin(client_session, asin, region)
     if not book:
         raise HTTPException(status_code=404, detail="Book not found")
 
@@ -16,6 +16,7 @@ from app.internal.auth.authentication import (
 )
 from app.internal.auth.config import LoginTypeEnum, auth_config
 from app.internal.auth.oidc_config import oidc_config
+from app.internal.book_search import metadata_router
 from app.internal.env_settings import Settings
 from app.internal.indexers.abstract import SessionContainer
 from app.internal.indexers.configuration import indexer_configuration_cache
@@ -23,9 +24,14 @@ from app.internal.indexers.indexer_util import IndexerContext, get_indexer_conte
 from app.internal.models import EventEnum, GroupEnum, Notification, User
 from app.internal.notifications import send_notification
 from app.internal.prowlarr.indexer_categories import indexer_categories
-from app.internal.prowlarr.prowlarr import flush_prowlarr_cache, prowlarr_config
+from app.internal.prowlarr.prowlarr import (
+    PAGE_SIZE,
+    flush_prowlarr_cache,
+    prowlarr_config,
+)
 from app.internal.ranking.quality import IndexerFlag, QualityRange, quality_config
 from app.util.connection import get_connection
+from app.util.provider_router import ProviderStats
 from app.util.db import get_session
 from app.util.templates import template_response
 from app.util.time import Minute
@@ -229,6 +235,10 @@ def read_prowlarr(
             "prowlarr_api_key": prowlarr_api_key,
             "indexer_categories": indexer_categories,
             "selected_categories": selected,
+            "parallel_search": prowlarr_config.get_parallel_search(session),
+            "indexer_timeout": prowlarr_config.get_indexer_timeout(session),
+            "max_results": prowlarr_config.get_max_results(session),
+            "query_expansion": prowlarr_config.get_query_expansion(session),
             "prowlarr_misconfigured": True if prowlarr_misconfigured else False,
             "version": Settings().app.version,
         },
@@ -259,6 +269,32 @@ def update_prowlarr_base_url(
     return Response(status_code=204, headers={"HX-Refresh": "true"})
 
 
+@router.put("/prowlarr/max-results")
+def update_prowlarr_max_results(
+    max_results: Annotated[int, Form(ge=PAGE_SIZE)],
+    session: Annotated[Session, Depends(get_session)],
+    admin_user: Annotated[
+        DetailedUser, Depends(get_authenticated_user(GroupEnum.admin))
+    ],
+):
+    prowlarr_config.set_max_results(session, max_results)
+    flush_prowlarr_cache()
+    return Response(status_code=204, headers={"HX-Refresh": "true"})
+
+
+@router.put("/prowlarr/query-expansion")
+def update_prowlarr_query_expansion(
+    session: Annotated[Session, Depends(get_session)],
+    admin_user: Annotated[
+        DetailedUser, Depends(get_authenticated_user(GroupEnum.admin))
+    ],
+    query_expansion: Annotated[bool, Form()] = False,
+):
+    prowlarr_config.set_query_expansion(session, query_expansion)
+    flush_prowlarr_cache()
+    return Response(status_code=204, headers={"HX-Refresh": "true"})
+
+
 @router.put("/prowlarr/category")
 def update_indexer_categories(
     request: Request,
@@ -285,6 +321,33 @@ def update_indexer_categories(
     )
 
 
+@router.put("/prowlarr/parallel-search")
+def update_parallel_search(
+    request: Request,
+    admin_user: Annotated[
+        DetailedUser, Depends(get_authenticated_user(GroupEnum.admin))
+    ],
+    session: Annotated[Session, Depends(get_session)],
+    indexer_timeout: Annotated[int, Form(ge=1)],
+    parallel_search: Annotated[bool, Form()] = False,
+):
+    prowlarr_config.set_parallel_search(session, parallel_search)
+    prowlarr_config.set_indexer_timeout(session, indexer_timeout)
+    flush_prowlarr_cache()
+
+    return template_response(
+        "settings_page/prowlarr.html",
+        request,
+        admin_user,
+        {
+            "parallel_search": parallel_search,
+            "indexer_timeout": indexer_timeout,
+            "success": "Search settings updated",
+        },
+        block_name="parallel_search",
+    )
+
+
 @router.get("/download")
 def read_download(
     request: Request,
@@ -785,3 +848,13 @@ async def update_indexers(
     flush_prowlarr_cache()
 
     raise ToastException("Indexers updated", "success")
+
+
+@router.get("/metadata-providers")
+def read_metadata_provider_stats(
+    admin_user: Annotated[
+        DetailedUser, Depends(get_authenticated_user(GroupEnum.admin))
+    ],
+) -> list[ProviderStats]:
+    """Rolling latency and error rate of the book metadata providers per region"""
+    return metadata_router.stats()
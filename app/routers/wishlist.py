@@ -9,26 +9,28 @@ from fastapi import (
     Depends,
     Form,
     HTTPException,
+    Query,
     Request,
     Response,
 )
 from fastapi.responses import RedirectResponse
 from sqlmodel import Session, asc, col, select
 
+from app.internal.backlog import search_backlog
+from app.internal.book_search import search_local_asins
+from app.internal.download_queue import enqueue_download
 from app.internal.models import (
     BookRequest,
     BookWishlistResult,
+    DownloadJob,
     GroupEnum,
     ManualBookRequest,
 )
-from app.internal.prowlarr.prowlarr import (
-    ProwlarrMisconfigured,
-    prowlarr_config,
-    start_download,
-)
-from app.internal.query import query_sources
+from app.internal.prowlarr.prowlarr import ProwlarrMisconfigured, prowlarr_config
+from app.internal.query import query_sources, source_searches, start_source_search
+from app.internal.ranking.quality import quality_config
 from app.internal.auth.authentication import DetailedUser, get_authenticated_user
-from app.util.connection import get_connection
+from app.util.connection import get_client_session, get_connection
 from app.util.db import get_session, open_session
 from app.util.templates import template_response
 
@@ -39,15 +41,21 @@ def get_wishlist_books(
     session: Session,
     username: Optional[str] = None,
     response_type: Literal["all", "downloaded", "not_downloaded"] = "all",
+    search_query: Optional[str] = None,
 ) -> list[BookWishlistResult]:
     """
     Gets the books that have been requested. If a username is given only the books requested by that
     user are returned. If no username is given, all book requests are returned.
+    If a search query is given, only books matching the query are returned.
     """
     if username:
         query = select(BookRequest).where(BookRequest.user_username == username)
     else:
         query = select(BookRequest).where(col(BookRequest.user_username).is_not(None))
+    if search_query:
+        query = query.where(
+            col(BookRequest.asin).in_(search_local_asins(session, search_query))
+        )
 
     book_requests = session.exec(query).all()
 
@@ -83,14 +91,15 @@ async def wishlist(
     request: Request,
     user: Annotated[DetailedUser, Depends(get_authenticated_user())],
     session: Annotated[Session, Depends(get_session)],
+    query: Annotated[Optional[str], Query(alias="q")] = None,
 ):
     username = None if user.is_admin() else user.username
-    books = get_wishlist_books(session, username, "not_downloaded")
+    books = get_wishlist_books(session, username, "not_downloaded", query)
     return template_response(
         "wishlist_page/wishlist.html",
         request,
         user,
-        {"books": books, "page": "wishlist"},
+        {"books": books, "page": "wishlist", "search_term": query or ""},
     )
 
 
@@ -99,14 +108,15 @@ async def downloaded(
     request: Request,
     user: Annotated[DetailedUser, Depends(get_authenticated_user())],
     session: Annotated[Session, Depends(get_session)],
+    query: Annotated[Optional[str], Query(alias="q")] = None,
 ):
     username = None if user.is_admin() else user.username
-    books = get_wishlist_books(session, username, "downloaded")
+    books = get_wishlist_books(session, username, "downloaded", query)
     return template_response(
         "wishlist_page/wishlist.html",
         request,
         user,
-        {"books": books, "page": "downloaded"},
+        {"books": books, "page": "downloaded", "search_term": query or ""},
     )
 
 
@@ -204,6 +214,19 @@ async def delete_manual(
     )
 
 
+async def background_refresh_sources(
+    asin: str, force_refresh: bool, requester_username: str
+):
+    with open_session() as session:
+        await query_sources(
+            asin=asin,
+            session=session,
+            client_session=get_client_session(),
+            force_refresh=force_refresh,
+            requester_username=requester_username,
+        )
+
+
 @router.post("/refresh/{asin}")
 async def refresh_source(
     asin: str,
@@ -212,16 +235,37 @@ async def refresh_source(
     force_refresh: bool = False,
 ):
     # causes the sources to be placed into cache once they're done
+    background_task.add_task(
+        background_refresh_sources,
+        asin=asin,
+        force_refresh=force_refresh,
+        requester_username=user.username,
+    )
+    return Response(status_code=202)
+
+
+async def background_search_backlog():
     with open_session() as session:
-        async with ClientSession() as client_session:
-            background_task.add_task(
-                query_sources,
-                asin=asin,
-                session=session,
-                client_session=client_session,
-                force_refresh=force_refresh,
-                requester_username=user.username,
-            )
+        await search_backlog(
+            session,
+            get_client_session(),
+            start_auto_download=quality_config.get_auto_download(session),
+        )
+
+
+@router.post("/search-backlog")
+async def start_backlog_search(
+    admin_user: Annotated[
+        DetailedUser, Depends(get_authenticated_user(GroupEnum.admin))
+    ],
+    session: Annotated[Session, Depends(get_session)],
+    background_task: BackgroundTasks,
+):
+    try:
+        prowlarr_config.raise_if_invalid(session)
+    except ProwlarrMisconfigured as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    background_task.add_task(background_search_backlog)
     return Response(status_code=202)
 
 
@@ -234,6 +278,7 @@ async def list_sources(
     ],
     session: Annotated[Session, Depends(get_session)],
     client_session: Annotated[ClientSession, Depends(get_connection)],
+    partial: bool = False,
 ):
     try:
         prowlarr_config.raise_if_invalid(session)
@@ -242,6 +287,33 @@ async def list_sources(
             "/settings/prowlarr?prowlarr_misconfigured=1", status_code=302
         )
 
+    if prowlarr_config.get_parallel_search(session):
+        book = session.exec(select(BookRequest).where(BookRequest.asin == asin)).first()
+        if not book:
+            raise HTTPException(status_code=404, detail="Book not found")
+
+        if partial:
+            # polls only show the progress of the search started by the full page
+            search = source_searches.get(asin)
+        else:
+            search = await start_source_search(
+                session, client_session, asin, admin_user.username
+            )
+            # cached sources are done almost immediately and do not need any polling
+            await search.wait(1)
+        return template_response(
+            "wishlist_page/sources.html",
+            request,
+            admin_user,
+            {
+                "book": book,
+                "sources": search.sources if search else [],
+                "search_done": search is None or search.done,
+                "pending_indexers": search.pending_indexers if search else [],
+            },
+            block_name="sources" if partial else None,
+        )
+
     result = await query_sources(
         asin,
         session=session,
@@ -256,6 +328,7 @@ async def list_sources(
         {
             "book": result.book,
             "sources": result.sources,
+            "search_done": True,
         },
     )
 
@@ -269,29 +342,47 @@ async def download_book(
         DetailedUser, Depends(get_authenticated_user(GroupEnum.admin))
     ],
     session: Annotated[Session, Depends(get_session)],
-    client_session: Annotated[ClientSession, Depends(get_connection)],
+    request: Request,
 ):
     try:
-        resp = await start_download(
-            session=session,
-            client_session=client_session,
-            guid=guid,
-            indexer_id=indexer_id,
-            requester_username=admin_user.username,
-            book_asin=asin,
-        )
+        prowlarr_config.raise_if_invalid(session)
     except ProwlarrMisconfigured as e:
         raise HTTPException(status_code=500, detail=str(e))
-    if not resp.ok:
-        raise HTTPException(status_code=500, detail="Failed to start download")
 
-    book = session.exec(select(BookRequest).where(BookRequest.asin == asin)).all()
-    for b in book:
-        b.downloaded = True
-        session.add(b)
-    session.commit()
+    job = enqueue_download(
+        session,
+        guid=guid,
+        indexer_id=indexer_id,
+        book_asin=asin,
+        requester_username=admin_user.username,
+    )
+    return template_response(
+        "wishlist_page/download_job.html",
+        request,
+        admin_user,
+        {"job": job},
+        status_code=202,
+    )
+
 
-    return Response(status_code=204)
+@router.get("/downloads/{job_id}")
+async def read_download_job(
+    request: Request,
+    job_id: uuid.UUID,
+    admin_user: Annotated[
+        DetailedUser, Depends(get_authenticated_user(GroupEnum.admin))
+    ],
+    session: Annotated[Session, Depends(get_session)],
+):
+    job = session.get(DownloadJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Download not found")
+    return template_response(
+        "wishlist_page/download_job.html",
+        request,
+        admin_user,
+        {"job": job},
+    )
 
 
 @router.post("/auto-download/{asin}")
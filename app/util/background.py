@@ -0,0 +1,22 @@
+import asyncio
+import logging
+from typing import Any, Coroutine
+
+logger = logging.getLogger(__name__)
+
+# keep references to running tasks so they are not garbage collected midway
+_background_tasks: set[asyncio.Task[Any]] = set()
+
+
+def _on_done(task: asyncio.Task[Any]):
+    _background_tasks.discard(task)
+    if not task.cancelled() and (exc := task.exception()):
+        logger.error("Background task %s failed: %s", task.get_name(), exc)
+
+
+def run_in_background(coro: Coroutine[Any, Any, Any]) -> asyncio.Task[Any]:
+    """Runs the coroutine without awaiting it. Exceptions are logged."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_on_done)
+    return task
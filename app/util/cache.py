@@ -1,5 +1,6 @@
 import time
 from abc import ABC
+from collections import OrderedDict
 from typing import Optional, overload
 
 from sqlmodel import Session, select
@@ -8,7 +9,14 @@ from app.internal.models import Config
 
 
 class SimpleCache[T]:
-    _cache: dict[tuple[str, ...], tuple[int, T]] = {}
+    """
+    In-memory cache. If `max_size` is given, the least recently used entries are
+    evicted once the cache grows larger.
+    """
+
+    def __init__(self, max_size: Optional[int] = None):
+        self.max_size = max_size
+        self._cache: OrderedDict[tuple[str, ...], tuple[float, T]] = OrderedDict()
 
     def get(self, source_ttl: int, *query: str) -> Optional[T]:
         hit = self._cache.get(query)
@@ -17,17 +25,23 @@ class SimpleCache[T]:
         cached_at, sources = hit
         if cached_at + source_ttl < time.time():
             return None
+        self._cache.move_to_end(query)
         return sources
 
-    def set(self, sources: T, *query: str):
-        self._cache[query] = (int(time.time()), sources)
+    def set(self, sources: T, *query: str, cached_at: Optional[float] = None):
+        self._cache[query] = (cached_at or time.time(), sources)
+        self._cache.move_to_end(query)
+        if self.max_size is not None:
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
 
     def flush(self):
-        self._cache = {}
+        self._cache = OrderedDict()
 
 
 class StringConfigCache[L: str](ABC):
-    _cache: dict[L, str] = {}
+    # unset keys are cached as None, so they do not hit the database every time
+    _cache: dict[L, Optional[str]] = {}
 
     @overload
     def get(self, session: Session, key: L) -> Optional[str]:
@@ -41,11 +55,12 @@ class StringConfigCache[L: str](ABC):
         self, session: Session, key: L, default: Optional[str] = None
     ) -> Optional[str]:
         if key in self._cache:
-            return self._cache[key]
-        return (
-            session.exec(select(Config.value).where(Config.key == key)).one_or_none()
-            or default
-        )
+            return self._cache[key] or default
+        value = session.exec(
+            select(Config.value).where(Config.key == key)
+        ).one_or_none()
+        self._cache[key] = value
+        return value or default
 
     def set(self, session: Session, key: L, value: str):
         old = session.exec(select(Config).where(Config.key == key)).one_or_none()
@@ -62,8 +77,7 @@ class StringConfigCache[L: str](ABC):
         if old:
             session.delete(old)
             session.commit()
-        if key in self._cache:
-            del self._cache[key]
+        self._cache[key] = None
 
     @overload
     def get_int(self, session: Session, key: L) -> Optional[int]:
@@ -1,6 +1,36 @@
+from typing import Optional
+
 import aiohttp
 
+from app.internal.env_settings import Settings
+
+_client_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_client_session() -> aiohttp.ClientSession:
+    """
+    Returns the client session shared across the whole app. Reusing it keeps
+    connections alive and caches DNS lookups between requests.
+    """
+    global _client_session
+    if _client_session is None or _client_session.closed:
+        settings = Settings().http
+        connector = aiohttp.TCPConnector(
+            limit=settings.max_connections,
+            limit_per_host=settings.max_connections_per_host,
+            ttl_dns_cache=settings.dns_cache_ttl,
+            keepalive_timeout=settings.keepalive_timeout,
+        )
+        _client_session = aiohttp.ClientSession(connector=connector)
+    return _client_session
+
+
+async def close_client_session():
+    global _client_session
+    if _client_session is not None:
+        await _client_session.close()
+        _client_session = None
+
 
 async def get_connection():
-    async with aiohttp.ClientSession() as session:
-        yield session
+    yield get_client_session()
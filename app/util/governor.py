@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncGenerator, Literal, Optional
+
+import aiohttp
+
+from app.internal.env_settings import Settings, UpstreamSettings
+
+logger = logging.getLogger(__name__)
+
+# status codes that signal the upstream is overloaded and the request can be retried
+_RETRY_STATUSES = {429, 502, 503, 504}
+_MAX_BACKOFF = 60
+
+
+class UpstreamUnavailable(aiohttp.ClientError):
+    """Raised while the circuit breaker of an upstream is open"""
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+class Upstream:
+    """
+    Governs all requests to a single upstream:
+    - a token bucket limits the request rate
+    - a semaphore limits the amount of requests in flight
+    - overloaded responses are retried after the Retry-After delay or an exponential backoff,
+      which all other requests to the upstream also wait for
+    - after consecutive failures the circuit opens and requests fail immediately until
+      a single trial request after `open_seconds` succeeds again
+    """
+
+    def __init__(self, name: str, settings: UpstreamSettings):
+        self.name = name
+        self.settings = settings
+        self._semaphore = asyncio.Semaphore(settings.max_in_flight)
+        self._tokens = float(settings.burst)
+        self._refilled_at = time.monotonic()
+        self._backoff_until = 0.0
+        self._failures = 0
+        self._open_until: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def circuit_open(self) -> bool:
+        return self._open_until is not None
+
+    def _enter_circuit(self) -> bool:
+        """Returns if the request is the trial request of a half-open circuit"""
+        if self._open_until is None:
+            return False
+        if time.monotonic() < self._open_until or self._trial_running:
+            raise UpstreamUnavailable(
+                f"{self.name} is unavailable after repeated failures"
+            )
+        self._trial_running = True
+        return True
+
+    def _record_success(self):
+        if self._open_until is not None:
+            logger.info("Upstream %s recovered, closing circuit", self.name)
+        self._failures = 0
+        self._open_until = None
+
+    def _record_failure(self):
+        self._failures += 1
+        if self._open_until is not None or (
+            self._failures >= self.settings.failure_threshold
+        ):
+            if self._open_until is None:
+                logger.warning(
+                    "Upstream %s failed %d times in a row, opening circuit for %ds",
+                    self.name,
+                    self._failures,
+                    self.settings.open_seconds,
+                )
+            self._open_until = time.monotonic() + self.settings.open_seconds
+
+    async def _acquire_token(self):
+        while True:
+            now = time.monotonic()
+            if self._backoff_until > now:
+                await asyncio.sleep(self._backoff_until - now)
+                continue
+            if self.settings.rate <= 0:
+                return
+            self._tokens = min(
+                self.settings.burst,
+                self._tokens + (now - self._refilled_at) * self.settings.rate,
+            )
+            self._refilled_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.settings.rate)
+
+    def _back_off(self, response: aiohttp.ClientResponse, attempt: int) -> float:
+        delay = _parse_retry_after(response.headers.get("Retry-After"))
+        if delay is None:
+            delay = min(_MAX_BACKOFF, 2**attempt + random.random())
+        self._backoff_until = max(self._backoff_until, time.monotonic() + delay)
+        return delay
+
+    @asynccontextmanager
+    async def request(
+        self,
+        client_session: aiohttp.ClientSession,
+        method: str,
+        url: str,
+        max_retries: Optional[int] = None,
+        **kwargs: Any,
+    ) -> AsyncGenerator[aiohttp.ClientResponse, None]:
+        """
+        `max_retries` overrides the configured retries, e.g. with 0 for requests that
+        must not be sent twice.
+        """
+        if max_retries is None:
+            max_retries = self.settings.max_retries
+        attempt = 0
+        while True:
+            trial = self._enter_circuit()
+            try:
+                await self._acquire_token()
+                async with self._semaphore:
+                    try:
+                        response = await client_session.request(method, url, **kwargs)
+                    except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                        self._record_failure()
+                        raise
+
+                    if response.status in _RETRY_STATUSES:
+                        # throttling is handled by backing off only. The upstream is
+                        # healthy and the circuit must not open because of it
+                        if response.status != 429:
+                            self._record_failure()
+                        if attempt < max_retries:
+                            response.release()
+                            delay = self._back_off(response, attempt)
+                            logger.info(
+                                "Upstream %s responded with %d, retrying in %.1fs",
+                                self.name,
+                                response.status,
+                                delay,
+                            )
+                            attempt += 1
+                            continue
+                    elif response.status >= 500:
+                        self._record_failure()
+                    else:
+                        self._record_success()
+
+                    try:
+                        yield response
+                    finally:
+                        response.release()
+                    return
+            finally:
+                if trial:
+                    self._trial_running = False
+
+    def get(self, client_session: aiohttp.ClientSession, url: str, **kwargs: Any):
+        return self.request(client_session, "GET", url, **kwargs)
+
+    def post(self, client_session: aiohttp.ClientSession, url: str, **kwargs: Any):
+        return self.request(client_session, "POST", url, **kwargs)
+
+
+UpstreamName = Literal["audible", "audimeta", "audnexus", "prowlarr", "mam", "covers"]
+_upstreams: dict[UpstreamName, Upstream] = {}
+
+
+def get_upstream(name: UpstreamName) -> Upstream:
+    """Returns the governor of the upstream. Limits are configured in `Settings().governor`."""
+    if name not in _upstreams:
+        settings: UpstreamSettings = getattr(Settings().governor, name)
+        _upstreams[name] = Upstream(name, settings)
+    return _upstreams[name]
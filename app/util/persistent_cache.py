@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Callable, Optional
+
+import pydantic
+from pydantic_core import from_json, to_json
+
+from app.internal.env_settings import Settings
+
+logger = logging.getLogger(__name__)
+
+
+class CacheResult[T](pydantic.BaseModel, frozen=True):
+    value: T
+    timestamp: float
+
+
+_lock = threading.Lock()
+_connection: Optional[sqlite3.Connection] = None
+_caches: list["PersistentCache[Any, Any]"] = []
+# amount of entries and bytes in the cache, so writes do not have to count them
+_entries = 0
+_bytes = 0
+
+
+def _get_connection() -> sqlite3.Connection:
+    """
+    All persistent caches share a single sqlite database that is separate from the
+    main database. It only holds data that can be refetched at any time, so it does
+    not need any migrations and can be deleted without losing anything.
+    """
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(
+            Settings().get_cache_path(),
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+            """
+        )
+        _connection.execute(
+            "CREATE INDEX IF NOT EXISTS ix_cache_accessed_at ON cache (accessed_at)"
+        )
+        _connection.execute(
+            "CREATE INDEX IF NOT EXISTS ix_cache_created_at ON cache (namespace, created_at)"
+        )
+        _recount(_connection)
+    return _connection
+
+
+def _recount(conn: sqlite3.Connection):
+    global _entries, _bytes
+    _entries, _bytes = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache"
+    ).fetchone()
+
+
+class PersistentCache[K: (str, pydantic.BaseModel), V]:
+    """
+    Cache that survives restarts by storing its values as JSON in a sqlite database.
+
+    All caches share a single entry and byte budget. Once either is exceeded, the least
+    recently used entries are evicted. Entries older than `ttl` are treated as misses and
+    are removed in the background by `expire_persistent_caches`. `ttl` can be a function,
+    so it can follow a setting that is changed at runtime.
+    Large values can be stored compressed with `compress`.
+
+    Reads and writes run in a thread, so the sqlite I/O does not block the event loop.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        ttl: int | Callable[[], int],
+        loader: Callable[[Any], V] = lambda x: x,
+        compress: bool = False,
+    ):
+        self.namespace = namespace
+        self._ttl = ttl
+        self.compress = compress
+        self._loader = loader
+        _caches.append(self)
+
+    @property
+    def ttl(self) -> int:
+        return self._ttl() if callable(self._ttl) else self._ttl
+
+    def _key(self, key: K) -> str:
+        if isinstance(key, pydantic.BaseModel):
+            return key.model_dump_json()
+        return key
+
+    async def get(self, key: K) -> Optional[CacheResult[V]]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: K, value: V):
+        await asyncio.to_thread(self._set, key, value)
+
+    def _get(self, key: K) -> Optional[CacheResult[V]]:
+        now = time.time()
+        with _lock:
+            conn = _get_connection()
+            row = conn.execute(
+                "SELECT value, created_at FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, self._key(key)),
+            ).fetchone()
+            if not row:
+                return None
+            value, created_at = row
+            if created_at + self.ttl < now:
+                return None
+            conn.execute(
+                "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, self.namespace, self._key(key)),
+            )
+        try:
+            if self.compress:
+                value = zlib.decompress(value)
+            return CacheResult(
+                value=self._loader(from_json(value)),
+                timestamp=created_at,
+            )
+        except (ValueError, pydantic.ValidationError, zlib.error) as e:
+            logger.warning("Failed to load cached value in %s: %s", self.namespace, e)
+            self.delete(key)
+            return None
+
+    def _set(self, key: K, value: V):
+        global _entries, _bytes
+        data = to_json(value)
+        if self.compress:
+            data = zlib.compress(data)
+        now = time.time()
+        with _lock:
+            conn = _get_connection()
+            old = conn.execute(
+                "SELECT size FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, self._key(key)),
+            ).fetchone()
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO cache (namespace, key, value, size, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (self.namespace, self._key(key), data, len(data), now, now),
+            )
+            if old:
+                _bytes += len(data) - old[0]
+            else:
+                _entries += 1
+                _bytes += len(data)
+            _evict(conn)
+
+    def delete(self, key: K):
+        with _lock:
+            conn = _get_connection()
+            conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, self._key(key)),
+            )
+            _recount(conn)
+
+    def expire(self) -> int:
+        with _lock:
+            conn = _get_connection()
+            cursor = conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND created_at < ?",
+                (self.namespace, time.time() - self.ttl),
+            )
+            if cursor.rowcount:
+                _recount(conn)
+            return cursor.rowcount
+
+    def flush(self):
+        with _lock:
+            conn = _get_connection()
+            conn.execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+            _recount(conn)
+
+
+def _evict(conn: sqlite3.Connection):
+    """Evicts the least recently used entries until the cache is within budget again."""
+    global _entries, _bytes
+    max_entries = Settings().cache.max_entries
+    max_bytes = Settings().cache.max_size_mb * 1_000_000
+    if _entries <= max_entries and _bytes <= max_bytes:
+        return
+
+    excess_entries = max(0, _entries - max_entries)
+    excess_bytes = max(0, _bytes - max_bytes)
+    to_delete: list[int] = []
+    for rowid, size in conn.execute(
+        "SELECT rowid, size FROM cache ORDER BY accessed_at"
+    ):
+        if excess_entries <= 0 and excess_bytes <= 0:
+            break
+        to_delete.append(rowid)
+        excess_entries -= 1
+        excess_bytes -= size
+        _entries -= 1
+        _bytes -= size
+
+    conn.executemany("DELETE FROM cache WHERE rowid = ?", [(r,) for r in to_delete])
+    logger.debug("Evicted %d entries from the persistent cache", len(to_delete))
+
+
+def _expire_all() -> int:
+    return sum(cache.expire() for cache in _caches)
+
+
+async def expire_persistent_caches():
+    """Periodically removes expired entries of all persistent caches."""
+    interval = Settings().cache.expire_interval
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            removed = await asyncio.to_thread(_expire_all)
+            if removed:
+                logger.debug("Removed %d expired cache entries", removed)
+        except sqlite3.Error as e:
+            logger.error("Failed to expire cache entries: %s", e)
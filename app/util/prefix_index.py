@@ -0,0 +1,62 @@
+import bisect
+from typing import Iterable
+
+from rapidfuzz import utils
+
+
+class PrefixIndex:
+    """
+    Sorted array of normalized strings for fast prefix lookups.
+
+    Every word of a value is indexed, so "kings" finds "The Way of Kings".
+    Values where the prefix matches the beginning are returned first.
+    """
+
+    def __init__(self, max_scan: int = 500):
+        self.max_scan = max_scan
+        # (normalized suffix, word position, original value)
+        self._keys: list[tuple[str, int, str]] = []
+        self._values: set[str] = set()
+
+    def __len__(self):
+        return len(self._values)
+
+    def _get_keys(self, value: str) -> list[tuple[str, int, str]]:
+        words = utils.default_process(value).split()
+        return [(" ".join(words[i:]), i, value) for i in range(len(words))]
+
+    def add(self, value: str):
+        if value in self._values:
+            return
+        self._values.add(value)
+        for key in self._get_keys(value):
+            bisect.insort(self._keys, key)
+
+    def add_all(self, values: Iterable[str]):
+        """Adds many values, sorting the keys once instead of on every insert"""
+        for value in values:
+            if value in self._values:
+                continue
+            self._values.add(value)
+            self._keys.extend(self._get_keys(value))
+        self._keys.sort()
+
+    def search(self, prefix: str, limit: int) -> list[str]:
+        normalized = " ".join(utils.default_process(prefix).split())
+        if not normalized:
+            return []
+        starts: list[str] = []
+        contains: list[str] = []
+        i = bisect.bisect_left(self._keys, (normalized,))
+        end = min(len(self._keys), i + self.max_scan)
+        while i < end and len(starts) < limit:
+            key, position, value = self._keys[i]
+            if not key.startswith(normalized):
+                break
+            if position == 0:
+                starts.append(value)
+            elif value not in contains:
+                contains.append(value)
+            i += 1
+        results = starts + [v for v in contains if v not in starts]
+        return results[:limit]
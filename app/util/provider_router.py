@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+import pydantic
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderStats(pydantic.BaseModel):
+    provider: str
+    region: str
+    samples: int
+    error_rate: float
+    p50_ms: Optional[float]
+    p95_ms: Optional[float]
+
+
+class _RollingStats:
+    def __init__(self, window: int):
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.errors: deque[bool] = deque(maxlen=window)
+
+    def record(self, latency: float, error: bool):
+        # failures are often fast, e.g. while a circuit is open. Only successful
+        # calls tell how long the provider takes to answer
+        if not error:
+            self.latencies.append(latency)
+        self.errors.append(error)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def error_rate(self) -> float:
+        if not self.errors:
+            return 0
+        return sum(self.errors) / len(self.errors)
+
+    def score(self) -> tuple[float, float]:
+        """
+        Lower is better. Providers are ordered by their error rate and only then by their
+        latency, so a fast failing provider is never preferred over a working one.
+        Providers without any samples are tried first.
+        """
+        return self.error_rate(), self.percentile(0.5) or 0
+
+
+class ProviderRouter[V]:
+    """
+    Routes requests to the healthiest of multiple interchangeable providers.
+
+    Latency and errors are tracked per provider and region over the last `window`
+    requests. If the first provider has not answered within its p95 latency, a hedged
+    request is sent to the next provider and whichever returns a result first wins.
+    Providers that fail are immediately followed up by the next one.
+    """
+
+    def __init__(
+        self,
+        providers: list[str],
+        window: int = 100,
+        min_hedge_delay: float = 0.2,
+        max_hedge_delay: float = 3.0,
+    ):
+        self.providers = providers
+        self.window = window
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_delay = max_hedge_delay
+        self._stats: dict[tuple[str, str], _RollingStats] = {}
+
+    def _get_stats(self, provider: str, region: str) -> _RollingStats:
+        key = (provider, region)
+        if key not in self._stats:
+            self._stats[key] = _RollingStats(self.window)
+        return self._stats[key]
+
+    def ranked(self, region: str) -> list[str]:
+        # sorting is stable, so providers keep their given order on ties
+        return sorted(self.providers, key=lambda p: self._get_stats(p, region).score())
+
+    def hedge_delay(self, provider: str, region: str) -> float:
+        p95 = self._get_stats(provider, region).percentile(0.95)
+        if p95 is None:
+            return self.max_hedge_delay
+        return min(self.max_hedge_delay, max(self.min_hedge_delay, p95))
+
+    async def _timed(
+        self,
+        provider: str,
+        region: str,
+        call: Callable[[str], Awaitable[Optional[V]]],
+    ) -> Optional[V]:
+        stats = self._get_stats(provider, region)
+        start = time.monotonic()
+        try:
+            result = await call(provider)
+        except asyncio.CancelledError:
+            # lost against a hedged request. The elapsed time is a lower bound of its latency
+            stats.record(time.monotonic() - start, False)
+            raise
+        except Exception as e:
+            logger.warning("Provider %s failed: %s", provider, e)
+            stats.record(time.monotonic() - start, True)
+            return None
+        # a missing result means the provider does not know the book, not that it failed
+        stats.record(time.monotonic() - start, False)
+        return result
+
+    async def fetch(
+        self,
+        region: str,
+        call: Callable[[str], Awaitable[Optional[V]]],
+    ) -> Optional[V]:
+        pending = self.ranked(region)
+        running: dict[asyncio.Task[Optional[V]], str] = {}
+
+        def start_next():
+            provider = pending.pop(0)
+            task = asyncio.create_task(self._timed(provider, region, call))
+            running[task] = provider
+
+        start_next()
+        try:
+            while running:
+                timeout = None
+                if pending:
+                    timeout = min(self.hedge_delay(p, region) for p in running.values())
+                done, _ = await asyncio.wait(
+                    running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    logger.debug("Hedging request to %s", pending[0])
+                    start_next()
+                    continue
+                for task in done:
+                    del running[task]
+                    result = task.result()
+                    if result is not None:
+                        return result
+                if not running and pending:
+                    start_next()
+            return None
+        finally:
+            for task in running:
+                task.cancel()
+
+    def stats(self) -> list[ProviderStats]:
+        return [
+            ProviderStats(
+                provider=provider,
+                region=region,
+                samples=len(stats.errors),
+                error_rate=stats.error_rate(),
+                p50_ms=_to_ms(stats.percentile(0.5)),
+                p95_ms=_to_ms(stats.percentile(0.95)),
+            )
+            for (provider, region), stats in sorted(self._stats.items())
+        ]
+
+
+def _to_ms(seconds: Optional[float]) -> Optional[float]:
+    if seconds is None:
+        return None
+    return round(seconds * 1000, 1)
@@ -0,0 +1,31 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable
+
+
+class SingleFlight[K: Hashable, V]:
+    """
+    Coalesces concurrent calls with the same key into a single execution.
+
+    The first caller for a key starts the work, every caller arriving while it is still
+    running awaits the same task and receives the same result (or exception).
+    The work runs as its own task, so a cancelled caller does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._in_flight: dict[K, asyncio.Task[V]] = {}
+
+    def is_in_flight(self, key: K) -> bool:
+        return key in self._in_flight
+
+    async def do(self, key: K, fn: Callable[[], Awaitable[V]]) -> V:
+        task = self._in_flight.get(key)
+        if task is None:
+
+            async def run() -> V:
+                return await fn()
+
+            task = asyncio.create_task(run())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        return await asyncio.shield(task)
@@ -0,0 +1,54 @@
+import asyncio
+import logging
+from typing import Callable, Hashable, Optional
+
+from app.util.background import run_in_background
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehind[K: Hashable, V]:
+    """
+    Collects writes in memory and hands them to `flush_fn` in one batch after `delay`
+    seconds. Later writes to the same key replace earlier ones. Pending values can be
+    read with `get`, so they are visible before they have been written.
+    """
+
+    def __init__(self, flush_fn: Callable[[list[V]], None], delay: float):
+        self.flush_fn = flush_fn
+        self.delay = delay
+        self._pending: dict[K, V] = {}
+        self._scheduled = False
+
+    def __len__(self):
+        return len(self._pending)
+
+    def get(self, key: K) -> Optional[V]:
+        return self._pending.get(key)
+
+    def put(self, key: K, value: V):
+        self._pending[key] = value
+        if not self._scheduled:
+            self._scheduled = True
+            run_in_background(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self._scheduled = False
+        self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        pending = self._pending
+        self._pending = {}
+        try:
+            self.flush_fn(list(pending.values()))
+        except Exception:
+            # keep the values for the next flush unless they have been replaced since
+            for key, value in pending.items():
+                self._pending.setdefault(key, value)
+            raise
+        logger.debug("Flushed %d pending writes", len(pending))